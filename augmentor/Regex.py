@@ -1,154 +1,148 @@
-import re
 import numpy as np
-from augmentor.modules import Tree, TRIM_MAX_REPEAT, InnerNode
-from augmentor.keywords import KeywordFactory
+from augmentor.modules import Tree
+from augmentor.parser import DSLParser
 
 
 class RegexSampler:
 
     def __init__(self):
         self.tree = Tree()
-        self.max_repeat_stack = []
-        self.in_weight_reading = False
-        self.weights_list = []
-        self.branch_stack = []
-        self.branch_weights_stack = []
-        self.branch_current_weights = []
-        self.branch_active_id = -1
-
-        self.all_chars = [chr(x) for x in range(32, 127)]
-        self.digits = [chr(x) for x in range(48, 58)]
-        self.not_digits = list(set(self.all_chars).difference(set(self.digits)))
-
-        self.small = [chr(x) for x in range(97, 123)]
-        self.capital = [chr(x) for x in range(65, 91)]
-
-        self.letters = self.small.copy()
-        self.letters.extend(self.capital)
-        self.not_letters = list(set(self.all_chars).difference(set(self.letters)))
-
-        self.alnum = self.digits.copy()
-        self.alnum.extend(self.letters)  # this is called word
-        self.not_alnum = list(set(self.all_chars).difference(set(self.alnum)))
-
-        self.wspace = [' ', '\t', '\n', '\r', '\f', '\v']
-        self.not_wspace = list(set(self.all_chars).difference(set(self.wspace)))
-
-        self.all_chars_with_wspace = self.all_chars.copy() + self.wspace.copy()
-
-        self.OPEN_IN_WEIGHT = 60
-        self.CLOSE_IN_WEIGHT = 62
-        self.DUMMY_ID = -1
-        self.char_counter = 0
-        self.last_open_in_position = -1
-        self.keep_father_for_regret = -1
-        self.keep_brother_for_regret = -1
-
-        self.OPEN_BRANCH_WEIGHT = 126
-        self.unsupported_keywords = {
-            #           'MIN_REPEAT',
-            'ASSERT',
-        }
-
-        self.keywords = {
-            'AT',
-            'MAX_REPEAT',
-            'SUBPATTERN',
-            'BRANCH',
-            'IN',
-            'GROUPREF'
-        }
-
-        self.generalized_literals_keyword = {
-            'LITERAL',
-            'NOT_LITERAL',
-            'CATEGORY',
-            'RANGE',
-            'ANY',
-        }
-
-        self.in_params = {  # no need for that just for the sake of completeness
-            'NEGATE'
-        }
-
-        self.at_params = {
-            'AT_BEGINNING': ['@@^@@ '],
-            'AT_END': [' @@$@@'],
-            'AT_BOUNDARY': [' @@b@@ '],
-            'AT_NON_BOUNDARY': ['@@B@@ '],
-        }
-
-        self.category_params = {
-            'CATEGORY_DIGIT': self.digits,
-            'CATEGORY_NOT_DIGIT': self.not_digits,
-            'CATEGORY_WORD': self.alnum,
-            'CATEGORY_NOT_WORD': self.not_alnum,
-            'CATEGORY_SPACE': self.wspace,
-            'CATEGORY_NOT_SPACE': self.not_wspace,
-        }
-
-        self.weights_boundary = '<>'
-
-        self.repeat_params = {'MAXREPEAT': TRIM_MAX_REPEAT}
-        self.keywords_factory = KeywordFactory(self)
-
-    def calibrate(self):
-        self.max_repeat_stack = []
-        self.in_weight_reading = False
-        self.weights_list = []
-        self.branch_stack = []
-        self.branch_weights_stack = []
-        self.branch_current_weights = []
-        self.branch_active_id = -1
-        self.char_counter = 0
-        self.last_open_in_position = -1
-        self.keep_father_for_regret = -1
-        self.keep_brother_for_regret = -1
-
-    def get_sample_from_traverse(self, max_samples, do_print):
-        sample = set()
-        i = 0
+        self.program = None
+        self.parser = DSLParser()
+        # efficiency of the last table: traversals done, distinct variants found, whether the language
+        # was enumerated and whether the traversals budget ran out before max_samples variants were found
+        self.traversals = 0
+        self.distinct = 0
+        self.enumerated = False
+        self.exhausted = False
+        # coverage of the last covering table: the options of the decision nodes and how many were hit
+        self.targets = 0
+        self.covered = 0
+
+    # a sampler over an already compiled program, e.g. one loaded from a bundle
+    @classmethod
+    def from_program(cls, program):
+        sampler = cls()
+        sampler.program = program
+        return sampler
+
+    # language_size is the program's language_size() when the caller already computed it
+    def get_sample_from_traverse(self, max_samples, do_print, rng=None, language_size=None):
+        if rng is None:
+            rng = np.random.default_rng()
         max_iterations = int(np.floor(5 * max_samples * (np.log(max_samples) + 1)))
         sample_with_freq = dict()
 
-        while (len(sample) < max_samples) and (i < max_iterations):
-            i += 1
-            lst = self.tree.traverse_tree(do_print, seed=None)
-            x = ''.join(lst)
-            if x in sample:
-                sample_with_freq[x] += 1
+        program = self.get_program()
+        if language_size is None:
+            language_size = program.language_size()
+        if language_size <= max_samples:
+            # small language, enumerate it and report the expected hit counts over the traversals budget
+            for x, p in program.enumerate().items():
+                sample_with_freq[x] = max(1, int(round(p * max_iterations)))
+            self.record_efficiency(0, len(sample_with_freq), True, False)
+            return list(sample_with_freq.keys()), sample_with_freq
+
+        i = self.fill_sample(program, sample_with_freq, max_samples, max_iterations, do_print, rng)
+        self.record_efficiency(i, len(sample_with_freq), False, len(sample_with_freq) < max_samples)
+        return list(sample_with_freq.keys()), sample_with_freq
+
+    # adds weighted traversals to sample_with_freq until it has max_samples variants or the traversals
+    # budget runs out, returns the number of traversals
+    def fill_sample(self, program, sample_with_freq, max_samples, max_iterations, do_print, rng):
+        i = 0
+        while (len(sample_with_freq) < max_samples) and (i < max_iterations):
+            if do_print:
+                batch = [''.join(program.sample(do_print, rng))]
             else:
-                sample.add(x)
-                sample_with_freq[x] = 1
-
-        return list(sample), sample_with_freq
-
-    def generate_tree(self, regex, max_samples=100, print_tree=False):
-        self.calibrate()
-        self.generate(re.sre_parse.parse(regex).data)
+                batch = program.sample_batch(min(max_samples, max_iterations - i), rng)
+            for x in batch:
+                i += 1
+                if x in sample_with_freq:
+                    sample_with_freq[x] += 1
+                else:
+                    sample_with_freq[x] = 1
+                if len(sample_with_freq) >= max_samples:
+                    break
+        return i
+
+    # Variants that exercise every BRANCH alternative and every MAX_REPEAT count of the expression: the
+    # covering traversals come first (see Program.covering_samples) and the rest of the max_samples budget
+    # is filled by weighted traversals. The frequencies count every traversal, so the covering ones give
+    # the rare alternatives a weight of about one traversal. self.targets and self.covered report the
+    # coverage, which is partial only when max_samples is smaller than the covering set.
+    def get_covering_sample(self, max_samples, rng=None):
+        if rng is None:
+            rng = np.random.default_rng()
+        max_iterations = int(np.floor(5 * max_samples * (np.log(max_samples) + 1)))
+        program = self.get_program()
+        covering, coverage = program.covering_samples(rng, max_samples)
+        self.record_coverage(coverage.num_targets, len(coverage.covered))
+        sample_with_freq = dict()
+        for x in covering:
+            sample_with_freq[x] = sample_with_freq.get(x, 0) + 1
+
+        i = self.fill_sample(program, sample_with_freq, max_samples, max_iterations, False, rng)
+        self.record_efficiency(len(covering) + i, len(sample_with_freq), False,
+                               len(sample_with_freq) < max_samples)
+        return list(sample_with_freq.keys()), sample_with_freq
+
+    def record_efficiency(self, traversals, distinct, enumerated, exhausted):
+        self.traversals = traversals
+        self.distinct = distinct
+        self.enumerated = enumerated
+        self.exhausted = exhausted
+
+    def record_coverage(self, targets, covered):
+        self.targets = targets
+        self.covered = covered
+
+    def get_program(self):
+        if self.program is None:
+            self.program = self.tree.compile()
+        return self.program
+
+    def compile(self, regex):
+        self.tree = self.parser.parse(regex)
+        self.program = None
+        return self.get_program()
+
+    def generate_tree(self, regex, max_samples=100, print_tree=False, rng=None):
+        self.compile(regex)
         if print_tree:
             self.tree.print()
 
-        return self.get_sample_from_traverse(max_samples, print_tree)
-
-    def generate(self, regex, start_of_expression=True, father_id=-1, brother_id=-1):
-        if start_of_expression:
-            start_of_expression = False
-            node = InnerNode()
-            node.type_str = 'EXPRESSION'
-            node_id = self.tree.add_inner_node(node, father_id, brother_id)
-            self.generate(regex, start_of_expression, node_id, -1)
-            return node_id
-
-        if not start_of_expression:
-            if len(regex) == 0:
-                return -1
-
-            current = regex[0]
-            rest_of_expression = regex[1:]
-            assert (type(current) == tuple)
-            assert (len(current) > 0)
-
-            node_id = self.keywords_factory.get_keyword(current).handle(current, father_id, brother_id)
-            self.generate(rest_of_expression, start_of_expression, -1, node_id)
-            return node_id
+        return self.get_sample_from_traverse(max_samples, print_tree, rng)
+
+    # (variants, probabilities) of the expression, exact when the language has at most max_samples
+    # derivations and estimated from the sampled frequencies otherwise
+    def generate_table(self, regex, max_samples=100, rng=None):
+        self.compile(regex)
+        return self.program_table(max_samples, rng)
+
+    def program_table(self, max_samples=100, rng=None):
+        program = self.get_program()
+        language_size = program.language_size()
+        if language_size <= max_samples:
+            variants, probabilities = program.probability_table()
+            self.record_efficiency(0, len(variants), True, False)
+            return variants, probabilities
+
+        variants, freq = self.get_sample_from_traverse(max_samples, False, rng, language_size)
+        counts = np.array([freq[v] for v in variants], dtype=np.float64)
+        return variants, counts / counts.sum()
+
+    # program_table with the sampled variants drawn by get_covering_sample. An enumerated language
+    # covers every target.
+    def coverage_table(self, max_samples=100, rng=None):
+        program = self.get_program()
+        if program.language_size() <= max_samples:
+            variants, probabilities = program.probability_table()
+            targets = program.coverage().num_targets
+            self.record_coverage(targets, targets)
+            self.record_efficiency(0, len(variants), True, False)
+            return variants, probabilities
+
+        variants, freq = self.get_covering_sample(max_samples, rng)
+        counts = np.array([freq[v] for v in variants], dtype=np.float64)
+        return variants, counts / counts.sum()
@@ -0,0 +1,68 @@
+import hashlib
+import os
+import pickle
+
+BUNDLE_VERSION = 2
+
+
+# hash of the contents of the rule files the bundle was built from
+def source_hash(expressions_fname):
+    if type(expressions_fname) != list:
+        expressions_fname = [expressions_fname]
+    digest = hashlib.sha256(f'augmentor-bundle-{BUNDLE_VERSION}'.encode())
+    for fname in expressions_fname:
+        with open(fname, 'rb') as f:
+            content = f.read()
+        digest.update(len(content).to_bytes(8, 'little'))
+        digest.update(content)
+    return digest.hexdigest()
+
+
+# The programs are pickled one by one, so that loading the bundle only unpickles the ones that are used
+# (see LazyPrograms). matcher_state is the cleaned patterns of the rules with the RuleMatcher state.
+def save_bundle(path, digest, expressions_df, programs, matcher_state):
+    bundle = {
+        'version': BUNDLE_VERSION,
+        'source_hash': digest,
+        'expressions': expressions_df,
+        'programs': LazyPrograms.packed(programs),
+        'matcher': matcher_state,
+    }
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(bundle, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)  # concurrent workers never see a partially written bundle
+
+
+# returns the bundle, or None when it is missing or was built from other rule files
+def load_bundle(path, digest):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            bundle = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    if bundle.get('version') != BUNDLE_VERSION or bundle.get('source_hash') != digest:
+        return None
+    return bundle
+
+
+class LazyPrograms(dict):
+    # compiled programs by expression, a value is unpickled from its bytes when it is first looked up
+
+    @staticmethod
+    def packed(programs):
+        return LazyPrograms((exp, program if isinstance(program, bytes) else
+                             pickle.dumps(program, protocol=pickle.HIGHEST_PROTOCOL))
+                            for exp, program in programs.items())
+
+    def __getitem__(self, exp):
+        program = super().__getitem__(exp)
+        if isinstance(program, bytes):
+            program = pickle.loads(program)
+            self[exp] = program
+        return program
+
+    def get(self, exp, default=None):
+        return self[exp] if exp in self else default
@@ -0,0 +1,89 @@
+import sys
+import threading
+from collections import OrderedDict
+
+
+class CacheEntry:
+    def __init__(self, program, pool):
+        self.program = program
+        self.pool = pool
+        self.nbytes = estimate_nbytes(program, pool)
+
+
+class SampleCache:
+    # LRU cache of compiled programs and their sample pools, bounded by number of entries and
+    # optionally by an estimate of their memory. It may be shared by threads, every operation holds a lock.
+
+    def __init__(self, max_entries=4096, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key).nbytes
+            self.entries[key] = entry
+            self.nbytes += entry.nbytes
+            while len(self.entries) > 1 and (len(self.entries) > self.max_entries or (
+                    self.max_bytes is not None and self.nbytes > self.max_bytes)):
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+
+    # drops the entries whose key satisfies predicate, returns how many were dropped
+    def discard_where(self, predicate):
+        with self.lock:
+            keys = [key for key in self.entries if predicate(key)]
+            for key in keys:
+                self.nbytes -= self.entries.pop(key).nbytes
+            return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def info(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'nbytes': self.nbytes, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions}
+
+
+def estimate_nbytes(program, pool):
+    nbytes = sum(sys.getsizeof(v) for v in pool.values) + pool.prob.nbytes + pool.alias.nbytes
+    if program is not None:
+        nbytes += program.opcode.nbytes + program.child.nbytes + program.brother.nbytes + program.arg.nbytes
+        nbytes += program.table_value.nbytes + program.table_cum.nbytes + program.table_start.nbytes
+        nbytes += sum(sys.getsizeof(leaf) for leaf in program.leaves)
+    return nbytes
@@ -1,47 +1,289 @@
+import hashlib
+import os
 import numpy as np
 import pandas as pd
 import re
+import threading
+import time
 
 from augmentor.Regex import RegexSampler
+from augmentor.bundle import load_bundle, save_bundle, source_hash
+from augmentor.cache import CacheEntry, SampleCache
+from augmentor.matcher import RuleMatcher
+from augmentor.parallel import iter_parallel_variations
+from augmentor.parser import strip_annotations
+from augmentor.modules import WeightedChoice, mixed_radix_digits, random_below, sample_distinct
+from augmentor.normalize import assemble, normalize_variation, separable
 from augmentor.reader import ExpressionsReader
+from augmentor.registry import RuleRegistry
+from augmentor.stats import StatsCollector, timed
+from augmentor.utterances import (MultiUtteranceReader, UtteranceReader, normalize_utterance, open_utterances,
+                                  utterances_format)
+from augmentor.writers import open_writer
+
+OUTPUT_ONLY_REGEX = 'QQQ([0-9]+)QQQ'
 
 
 class Augmentor:
-    def __init__(self, expressions_fname, utterances_fname, read_utterances_as_text=True):  # type: ignore
-        self.expr_reader = ExpressionsReader()
-        self.expressions_df = self.expr_reader.read_expressions(expressions_fname)
-        self.output_only_expr = self.expressions_df[self.expressions_df.output_only == True].copy()
-        self.expressions_df = self.expressions_df[self.expressions_df.output_only == False].copy()
-        self.utterances = self.read_utterances_file(utterances_fname, read_utterances_as_text)
-        self.rules_counter = 0
+    def __init__(self, expressions_fname, utterances_fname, read_utterances_as_text=True, cache_entries=4096,
+                 cache_bytes=None, resolved_expressions=None, seed=None, stats=None, shard=None,
+                 coverage=False, matcher_state=None):  # type: ignore
+        # optional StatsCollector that records the time of every phase and the sampling cost of every rule
+        self.stats = stats
+        self.expr_reader = ExpressionsReader(stats)
+        self.expressions_fname = expressions_fname
+        # the rules in the order of the files as (expression, rewritten expression, name, resolved expression),
+        # read again only when update_rules needs them and the augmentor was built from resolved rules
+        self.source_rules = None
+        if resolved_expressions is None:
+            resolved_expressions, self.source_rules = self.expr_reader.prepare_expressions(
+                self.expr_reader.read_rules(expressions_fname))
+        # the resolved rules of the rule files
+        rules = RuleRegistry.from_dataframe(resolved_expressions[resolved_expressions.output_only == False])
+        # matcher_state, as saved in a bundle, spares cleaning the patterns and combining them into chunks
+        previous = None if matcher_state is None else RuleMatcher.from_state(matcher_state[1])
+        rule_matcher, clean_patterns = self.build_rule_matcher(
+            rules, previous, {} if matcher_state is None else matcher_state[0])
+        self.snapshot = RulesSnapshot(rules, rule_matcher,
+                                      resolved_expressions[resolved_expressions.output_only == True].copy(),
+                                      clean_patterns)
+        # streamed from the files on every pass, not held in memory
+        self.utterances = self.read_utterances_file(utterances_fname, read_utterances_as_text, shard)
         self.current_utter_fragmentations = []
+        self.sample_cache = SampleCache(cache_entries, cache_bytes)
+        self.compiled_programs = {}
+        # master seed, every utterance and every rule get their own random stream derived from it
+        self.seed = np.random.SeedSequence(seed).entropy
+        # draw the sample pool of every rule with RegexSampler.coverage_table, so every alternative and repeat
+        # count of the rule is in its pool
+        self.coverage = coverage
+        # serializes the rule updates when the augmentor serves several threads
+        self.rules_lock = threading.RLock()
 
-    def read_utterances_file(self, utterances_fname, as_text=True):
-        if type(utterances_fname) == list:
-            all = []
-            for f in utterances_fname:
-                all.extend(self.read_utterances_file(f))
-            return all
+    # The current rules, their matcher and output only table. An update publishes them together in a new
+    # snapshot, so a request that reads self.snapshot once sees one version of the rules throughout.
+    @property
+    def rules(self):
+        return self.snapshot.rules
+
+    @property
+    def rule_matcher(self):
+        return self.snapshot.rule_matcher
+
+    @property
+    def output_only_expr(self):
+        return self.snapshot.output_only_expr
+
+    # the rules as a table, for inspection
+    @property
+    def expressions_df(self):
+        return self.rules.to_dataframe()
+
+    # Loads the resolved rules, the rule matcher chunks and the compiled trees from the bundle at
+    # bundle_path. The bundle is rebuilt from expressions_fname when it is missing or when the rule files
+    # changed since. The trees are unpickled when their rule is first used and the matcher chunks are
+    # compiled on the first rewrite.
+    @classmethod
+    def from_bundle(cls, bundle_path, expressions_fname, utterances_fname, **kwargs):
+        digest = source_hash(expressions_fname)
+        bundle = load_bundle(bundle_path, digest)
+        if bundle is None:
+            augmentor = cls(expressions_fname, utterances_fname, **kwargs)
+            augmentor.save_bundle(bundle_path, digest)
+            return augmentor
+
+        augmentor = cls(expressions_fname, utterances_fname, resolved_expressions=bundle['expressions'],
+                        matcher_state=bundle['matcher'], **kwargs)
+        augmentor.compiled_programs = bundle['programs']
+        return augmentor
+
+    # the resolved rules, as needed to rebuild this augmentor in a worker process
+    def worker_state(self):
+        snapshot = self.snapshot
+        return pd.concat([snapshot.rules.to_dataframe(), snapshot.output_only_expr])
+
+    def worker_kwargs(self):
+        return {'cache_entries': self.sample_cache.max_entries, 'cache_bytes': self.sample_cache.max_bytes,
+                'seed': self.seed, 'stats': None if self.stats is None else StatsCollector(),
+                'coverage': self.coverage}
+
+    # The streams are children of the master seed, like SeedSequence.spawn creates them, but their
+    # spawn keys come from the utterance text or the rule expression instead of a spawn counter. The
+    # output therefore does not depend on the order or the process in which utterances are handled.
+    def utterance_rng(self, utter):
+        return np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=(0, stable_key(utter))))
+
+    def rule_rng(self, exp, max_variants):
+        return np.random.default_rng(
+            np.random.SeedSequence(self.seed, spawn_key=(1, stable_key(exp), max_variants)))
+
+    # the stream of fragments drawn without a given rng, keyed by the values of the fragments
+    def fragments_rng(self, frags):
+        values = '\x00'.join('\x01'.join(frag.values) for frag in frags)
+        return np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=(2, stable_key(values))))
+
+    def save_bundle(self, bundle_path, digest):
+        snapshot = self.snapshot
+        for exp in snapshot.rules.expressions:
+            if exp in self.compiled_programs:
+                continue
+            try:
+                self.compiled_programs[exp] = RegexSampler().compile(exp)
+            except Exception:
+                continue  # rules that do not compile raise when they are used, as without a bundle
+        save_bundle(bundle_path, digest, pd.concat([snapshot.rules.to_dataframe(), snapshot.output_only_expr]),
+                    self.compiled_programs, (snapshot.clean_patterns, snapshot.rule_matcher.state()))
+
+    # the matcher of the rules and their cleaned patterns, reusing the compiled chunks of the previous
+    # matcher and the cleaned patterns of previous_patterns
+    def build_rule_matcher(self, rules, previous=None, previous_patterns=None):
+        previous_patterns = previous_patterns or {}
+        clean_patterns = {}
+        for exp in rules.expressions:
+            if exp not in clean_patterns:
+                clean_patterns[exp] = previous_patterns[exp] if exp in previous_patterns else self.clean_exp(exp)
+        rule_matcher = RuleMatcher(previous=previous)
+        rule_matcher.add_rules((name, clean_patterns[exp]) for name, exp in rules)
+        return rule_matcher, clean_patterns
+
+    # Changes rules without reading the rule files again. changed_rows are (expression, logical_rule_name)
+    # pairs or a DataFrame with these columns, a new name adds a rule and an expression of None removes it.
+    # Only the changed rules and the rules that reference them, directly or not, are resolved again and
+    # only their cached pools and compiled programs are dropped. Returns the names of these rules.
+    # The rules are those of a full read of the changed files, except that the output only alternatives
+    # of the changed rules get new placeholders numbered after the existing ones, so the QQQnQQQ
+    # placeholders of these rules and of their dependents can differ from a full read.
+    def update_rules(self, changed_rows):
+        if isinstance(changed_rows, pd.DataFrame):
+            changed_rows = zip(changed_rows.expression, changed_rows.logical_rule_name)
+        changes = {}
+        for expr, name in changed_rows:
+            changes[self.expr_reader.normalize_expr(name)] = None if expr is None else \
+                self.expr_reader.normalize_expr(expr)
+        with self.rules_lock:
+            return self.apply_rule_changes(changes)
 
+    # Reads the rule files again and applies the rules that changed since they were read, see update_rules
+    def reload_rules(self):
+        df = self.expr_reader.read_rules(self.expressions_fname)
+        with self.rules_lock:
+            current = {}
+            for expr, _, name, _ in self.get_source_rules():
+                current.setdefault(name, expr)
+            new = {}
+            for expr, name in zip(df.expression, df.logical_rule_name):
+                new.setdefault(name, expr)
+            changes = [(expr, name) for name, expr in new.items() if current.get(name) != expr]
+            changes.extend((None, name) for name in current if name not in new)
+            return self.update_rules(changes) if changes else []
+
+    def get_source_rules(self):
+        if self.source_rules is None:
+            if self.expressions_fname is None:
+                raise Exception('Error the rules of this augmentor were not read from files')
+            _, self.source_rules = self.expr_reader.prepare_expressions(
+                self.expr_reader.read_rules(self.expressions_fname))
+        return self.source_rules
+
+    def apply_rule_changes(self, changes):
+        source_rules = self.get_source_rules()
+
+        # the changed rules get new placeholders for their output only alternatives
+        rewritten, new_output_only = {}, None
+        new_rows = [(expr, name) for name, expr in changes.items() if expr is not None]
+        if new_rows:
+            df = pd.DataFrame(new_rows, columns=["expression", "logical_rule_name"])
+            df = self.expr_reader.replace_output_only(df, self.next_output_only_id())
+            rules = df[df.output_only == 0]
+            rewritten = dict(zip(rules.logical_rule_name, rules.expression))
+            new_output_only = df[df.output_only == 1]
+
+        rows = []
+        for row in source_rules:
+            name = row[2]
+            if name not in changes:
+                rows.append(row[:3])
+            elif changes[name] is not None and name in rewritten:
+                rows.append((changes[name], rewritten.pop(name), name))
+        rows.extend((changes[name], expr, name) for name, expr in rewritten.items())
+        names = [row[2] for row in rows]
+        exprs = [row[1] for row in rows]
+
+        # the changed rules and their transitive dependents are resolved again
+        dependents = {}
+        for name, expr in zip(names, exprs):
+            for ref in set(re.findall(self.expr_reader.ref_regex, expr)):
+                dependents.setdefault(ref, set()).add(name)
+        affected = set(changes)
+        queue_ = list(changes)
+        while queue_:
+            for name in dependents.get(queue_.pop(), ()):
+                if name not in affected:
+                    affected.add(name)
+                    queue_.append(name)
+        keep = {(name, expr): resolved for _, expr, name, resolved in source_rules if name not in affected}
+        order, resolved = self.expr_reader.resolve_rules(names, exprs, keep)
+
+        # nothing changed so far, an unresolved reference or a cycle leaves the augmentor as it was
+        stale = set(row[3] for row in source_rules if row[2] in affected)
+        dropped = set()
+        for row in source_rules:
+            if row[2] in changes:
+                dropped.update(f'QQQ{n}QQQ' for n in re.findall(OUTPUT_ONLY_REGEX, row[1]))
+
+        # the new rules are published at once when they are complete, requests use either version
+        snapshot = self.snapshot
+        rules = RuleRegistry([(names[i], resolved[i]) for i in reversed(order)])
+        output_only_expr = snapshot.output_only_expr[~snapshot.output_only_expr.logical_rule_name.isin(dropped)]
+        if new_output_only is not None:
+            output_only_expr = pd.concat([output_only_expr, new_output_only])
+        rule_matcher, clean_patterns = self.build_rule_matcher(rules, snapshot.rule_matcher, snapshot.clean_patterns)
+        self.source_rules = [row + (expr,) for row, expr in zip(rows, resolved)]
+        self.snapshot = RulesSnapshot(rules, rule_matcher, output_only_expr, clean_patterns)
+
+        stale.difference_update(resolved)
+        self.sample_cache.discard_where(lambda key: key[0] in stale)
+        if self.compiled_programs:
+            # loaded from a bundle, the affected rules are compiled again right away like the others
+            for exp in stale:
+                self.compiled_programs.pop(exp, None)
+            for name, expr in zip(names, resolved):
+                if name in affected and expr not in self.compiled_programs:
+                    try:
+                        self.compiled_programs[expr] = RegexSampler().compile(expr)
+                    except Exception:
+                        continue  # rules that do not compile raise when they are used
+        return sorted(affected)
+
+    def next_output_only_id(self):
+        ids = [int(n) for name in self.output_only_expr.logical_rule_name
+               for n in re.findall(OUTPUT_ONLY_REGEX, name)]
+        return max(ids) + 1 if ids else 0
+
+    # Reloads the rule files with reload_rules whenever they are modified, checked every interval seconds
+    # by a daemon thread. Returns the watcher, call its stop() to end the watch.
+    def watch_rules(self, interval=1.0, on_error=None):
+        watcher = RulesWatcher(self, interval, on_error)
+        watcher.start()
+        return watcher
+
+    # A reader that streams the utterances of the file (or list of files), see augmentor.utterances. Text
+    # files give one utterance per line, other files the "response" column of a csv or the utterances of a
+    # .jsonl file. With shard=(index, count) only that share of every file is read. A reader is used as is.
+    def read_utterances_file(self, utterances_fname, as_text=True, shard=None):
+        if isinstance(utterances_fname, (UtteranceReader, MultiUtteranceReader)):
+            return utterances_fname
         if as_text:
-            file_handler = open(utterances_fname, "r")
-            utterances = file_handler.readlines()
-            file_handler.close()
-        else:
-            converters = {"response": self.normalize_utterance}
-            df = pd.read_csv(utterances_fname, comment="#", converters=converters)
-            utterances = df["response"].values.tolist()
-            utterances = utterances[:10]
-        return utterances
-
-    def calc_variations(self, max_variants=500, do_print=False):
+            return open_utterances(utterances_fname, 'text', shard)
+        if type(utterances_fname) == list:
+            return MultiUtteranceReader([self.read_utterances_file(f, as_text, shard) for f in utterances_fname])
+        fmt = 'jsonl' if utterances_format(utterances_fname) == 'jsonl' else 'csv'
+        return open_utterances(utterances_fname, fmt, shard)
+
+    def calc_variations(self, max_variants=500, do_print=False, jobs=1, unique=False):
         out = {}
-        for utterance in self.utterances:
-            variations = self.get_variations_list(utterance, max_variants)
-            print("Uniqe variations:")
-            print(len(list(set(variations))))
-            print(list(set(variations)))
-            out[utterance] = [self.normalize_variation(v) for v in variations]
+        for utterance, variant in self.iter_variations(max_variants, do_print=do_print, jobs=jobs, unique=unique):
+            out.setdefault(utterance, []).append(variant)
 
         if do_print:
             print('@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@')
@@ -52,17 +294,64 @@ class Augmentor:
 
         return out
 
-    def get_variations_list(self, utter, max_variants=100):
-        print(f"Original = {utter}")
-        utter = self.change_to_logical_rules(utter)
-        print(f"Convert To Logical Rules = {utter}")
-        print()
-        self.current_utter_fragmentations = self.get_utter_fragmentations(utter, max_variants)
-        return self.calc_variations_for_utterance(max_variants)
+    # yields (utterance, normalized variant) records one utterance at a time, with jobs > 1 the
+    # utterances are fanned out to a process pool (see iter_parallel_variations)
+    def iter_variations(self, max_variants=500, utterances=None, do_print=False, jobs=1, ordered=True, unique=False):
+        if utterances is None:
+            utterances = self.utterances
+        if jobs > 1:
+            for utterance, variations in iter_parallel_variations(self, utterances, max_variants, jobs, ordered,
+                                                                           unique=unique):
+                for v in variations:
+                    yield utterance, v
+            return
+
+        for utterance in utterances:
+            variations = self.get_variations_list(utterance, max_variants, do_print, unique, normalized=True)
+            if do_print:
+                print("Uniqe variations:")
+                print(len(list(set(variations))))
+                print(list(set(variations)))
+            for v in variations:
+                yield utterance, v
+
+    # streams the variations to a .jsonl/.csv file (optionally .gz) without holding them in memory
+    def write_variations(self, out_fname, max_variants=500, utterances=None, buffer_size=10000, jobs=1,
+                         ordered=True, unique=False):
+        with open_writer(out_fname, buffer_size) as writer:
+            records = self.iter_variations(max_variants, utterances, jobs=jobs, ordered=ordered, unique=unique)
+            writer.write_all((u.strip(), v) for u, v in records)
+            return writer.records
 
-    def change_to_logical_rules(self, utter):
+    # the variants of utter, normalized (see normalize_variation) when normalized=True
+    def get_variations_list(self, utter, max_variants=100, do_print=False, unique=False, normalized=False):
+        rng = self.utterance_rng(utter)
+        if do_print:
+            print(f"Original = {utter}")
+        definitions = {}
+        snapshot = self.snapshot
+        with timed(self.stats, 'rule_matching'):
+            utter = self.change_to_logical_rules(utter, definitions, snapshot)
+        if do_print:
+            print(f"Convert To Logical Rules = {utter}")
+            print()
+        frags = self.get_utter_fragmentations(utter, max_variants, definitions, snapshot)
+        self.current_utter_fragmentations = frags
+        with timed(self.stats, 'assembly'):
+            return self.variations_of_fragments(frags, max_variants, rng, unique, normalized)
+
+    # Replaces the in-text definitions of utter by references and the text that rules match by theirs.
+    # The definitions go into `definitions` (reference -> expression) and apply to this utterance only,
+    # ahead of the rules of the same name, so the variants of an utterance never depend on the ones
+    # handled before it. The rules are those of snapshot, by default the current ones.
+    def change_to_logical_rules(self, utter, definitions=None, snapshot=None):
+        if definitions is None:
+            definitions = {}
+        if snapshot is None:
+            snapshot = self.snapshot
         new_utter = utter
         utter += ' '
+        unnamed = 0
 
         # look for in-text regex definition
         for match in re.finditer('\([a-zA-Z0-9 |%~<>+?*:,]+\)', utter):
@@ -71,86 +360,205 @@ class Augmentor:
             if logical_rule:
                 logical_rule = logical_rule[0][:-1]
                 replace_to = f'<<{logical_rule}>>'
-                exp = '(' + utter[utter.index(':') + 1: match.end()]
+                exp = '(' + utter[utter.index(':', match.start()) + 1: match.end()]
             else:
-                x = self.expressions_df[self.expressions_df['expression'] == f'({match_str})']
-                if len(x) > 0:
-                    replace_to = str(x['logical_rule_name'].to_list()[0])
-                else:
-                    replace_to = f'<<{self.rules_counter}>>'
-                exp = match_str
-
-            df = pd.DataFrame([[exp, replace_to]], columns=["expression", "logical_rule_name"])
-            df = self.expr_reader.replace_output_only(df)
-            self.expressions_df = self.expressions_df.append(df)
+                # an unnamed definition is the rule with the same expression, or else a new numbered one
+                replace_to = snapshot.rules.name_of(f'({match_str})')
+                exp = None
+                if replace_to is None:
+                    replace_to = f'<<{unnamed}>>'
+                    unnamed += 1
+                    exp = match_str
+
+            if exp is not None and replace_to not in definitions:
+                definitions[replace_to], _ = self.expr_reader.rewrite_output_only(exp)
             new_utter = new_utter.replace(match_str, replace_to)
 
         # look for match according to regex
-        for i in range(len(self.expressions_df)):
-            exp = str(self.expressions_df.iloc[i].expression)[:-1] + '+[^>>])'
-            exp = self.clean_exp(exp)
-            for exp_match in re.finditer(exp, new_utter):
-                to_replace = new_utter[exp_match.start(): exp_match.end() - 1]
-                replace_by = self.expressions_df.iloc[i].logical_rule_name
-                new_utter = new_utter.replace(to_replace, replace_by)
-
-        return new_utter
+        return snapshot.rule_matcher.rewrite(new_utter)
 
     def clean_exp(self, exp):
-        new_exp = exp
-        for match in re.finditer('( ~[0-9]*|<[0-9]+(,[0-9]+)*>)', exp):
-            to_replace = exp[match.start(): match.end()]
-            start = new_exp.index(to_replace)
-            new_exp = new_exp[:start] + new_exp[start + len(to_replace):]
-
-        return new_exp
+        return strip_annotations(exp)
 
-    def get_utter_fragmentations(self, utter, max_variants):
+    def get_utter_fragmentations(self, utter, max_variants, definitions=None, snapshot=None):
+        if definitions is None:
+            definitions = {}
+        if snapshot is None:
+            snapshot = self.snapshot
         frags = []
         last_frag = 0
         for match in re.finditer('<<[a-zA-Z0-9_]+>>', utter):
-            frags.append([utter[last_frag: match.start()]])
+            frags.append(WeightedChoice([utter[last_frag: match.start()]]))
             last_frag = match.end()
             logical_rule = utter[match.start(): match.end()]
-            curr_exp = \
-                self.expressions_df[self.expressions_df['logical_rule_name'] == logical_rule].expression.to_list()[0]
+            curr_exp = definitions.get(logical_rule)
+            if curr_exp is None:
+                curr_exp = snapshot.rules.expression_of(logical_rule)
+            if curr_exp is None:
+                raise Exception(f'Error unknown rule {logical_rule}')
 
-            reg_samp = RegexSampler()
+            frags.append(self.get_rule_pool(logical_rule, curr_exp, max_variants))
 
-            _, options_freq = reg_samp.generate_tree(curr_exp, max_variants)
-            frag = []
-            for key in options_freq.keys():
-                if 'QQQ' not in key:
-                    frag.extend(int(options_freq[key]) * [key])
-            frags.append(frag)
-
-        frags.append([utter[last_frag:]])
+        frags.append(WeightedChoice([utter[last_frag:]]))
         return frags
 
-    def calc_variations_for_utterance(self, max_variants):
-        variation = []
-        for _ in range(max_variants):
-            variant = []
-            for frag in self.current_utter_fragmentations:
-                if len(frag) == 1:
-                    variant.extend(frag)
-                else:
-                    to_add = frag[np.random.randint(0, len(frag), 1)[0]]
-                    variant.append(to_add)
-            v = "".join(variant)
-            variation.append(v)
-        return variation
+    # compiled tree and weighted sample pool of an expression, shared by all the rule occurrences
+    def get_rule_pool(self, logical_rule, curr_exp, max_variants):
+        key = (curr_exp, max_variants, self.seed, self.coverage)
+        entry = self.sample_cache.get(key)
+        rule_stats = None if self.stats is None else self.stats.rule(logical_rule, curr_exp)
+        if rule_stats is not None:
+            with self.stats.lock:
+                rule_stats.uses += 1
+        if entry is None:
+            start = time.perf_counter()
+            program = self.compiled_programs.get(curr_exp)
+            if program is not None:
+                reg_samp = RegexSampler.from_program(program)
+            else:
+                reg_samp = RegexSampler()
+                reg_samp.compile(curr_exp)
+            compiled = time.perf_counter()
+            rng = self.rule_rng(curr_exp, max_variants)
+            if self.coverage:
+                variants, probabilities = reg_samp.coverage_table(max_variants, rng)
+            else:
+                variants, probabilities = reg_samp.program_table(max_variants, rng)
+            sampled = time.perf_counter()
+            if rule_stats is not None:
+                self.record_rule_stats(rule_stats, reg_samp, compiled - start, sampled - compiled)
+            keep = ['QQQ' not in v for v in variants]
+            variants = [v for v, k in zip(variants, keep) if k]
+            probabilities = probabilities[keep]
+            if len(variants) == 0:
+                raise Exception(f'Rule {logical_rule} has only output only variants')
+            entry = CacheEntry(reg_samp.get_program(), WeightedChoice(variants, probabilities))
+            self.sample_cache.put(key, entry)
+        return entry.pool
+
+    def record_rule_stats(self, rule_stats, reg_samp, compile_time, sample_time):
+        self.stats.add_phase('compile', compile_time)
+        self.stats.add_phase('sampling', sample_time)
+        with self.stats.lock:
+            rule_stats.builds += 1
+            rule_stats.compile_time += compile_time
+            rule_stats.sample_time += sample_time
+            rule_stats.traversals += reg_samp.traversals
+            rule_stats.distinct += reg_samp.distinct
+            rule_stats.enumerated += int(reg_samp.enumerated)
+            rule_stats.exhausted += int(reg_samp.exhausted)
+            rule_stats.targets += reg_samp.targets
+            rule_stats.covered += reg_samp.covered
+
+    # With unique=True the variants are distinct, drawn uniformly without replacement from the product of
+    # the fragments, so min(max_variants, number of distinct variants) variants are returned.
+    def calc_variations_for_utterance(self, max_variants, rng=None, unique=False, normalized=False):
+        return self.variations_of_fragments(self.current_utter_fragmentations, max_variants, rng, unique, normalized)
+
+    def variations_of_fragments(self, frags, max_variants, rng=None, unique=False, normalized=False):
+        if rng is None:
+            rng = self.fragments_rng(frags)
+        if unique:
+            if normalized and separable([frag.split_values() for frag in frags]):
+                frags = [frag.merge_normalized() for frag in frags]
+            return self.distinct_variants(frags, max_variants, rng, normalized)
+        rows = zip(*[frag.draw_indices(max_variants, rng).tolist() for frag in frags])
+        return self.assemble_variants(frags, rows, normalized)
+
+    # Distinct variants from distinct indices of the product of the fragments, drawn uniformly without
+    # replacement. Different indices can still give the same variant, e.g. "x" and "x " before " now", so
+    # more indices are drawn for the repeated ones until the product is exhausted.
+    def distinct_variants(self, frags, max_variants, rng, normalized=False):
+        n = self.num_variants(frags)
+        sizes = [len(frag) for frag in frags]
+        drawn = set()
+        variants = []
+        seen = set()
+        indices = sample_distinct(n, max_variants, rng)
+        while indices:
+            drawn.update(indices)
+            for v in self.assemble_variants(frags, [mixed_radix_digits(k, sizes) for k in indices], normalized):
+                if v not in seen:
+                    seen.add(v)
+                    variants.append(v)
+            missing = max_variants - len(variants)
+            if missing <= 0 or len(drawn) >= n:
+                break
+            indices = self.more_indices(n, missing, drawn, rng)
+        return variants
+
+    # up to `missing` more distinct indices of range(n) that are not in drawn
+    def more_indices(self, n, missing, drawn, rng):
+        if n - len(drawn) <= 2 * missing:
+            rest = [k for k in range(n) if k not in drawn]
+            return [rest[i] for i in rng.permutation(len(rest))[:missing]]
+        indices = set()
+        while len(indices) < missing:
+            k = random_below(n, rng)
+            if k not in drawn:
+                indices.add(k)
+        return list(indices)
+
+    # Joins the values at every row of indices into a variant. Normalized variants are joined from the
+    # values split once per fragment, so normalizing costs no regex work per variant, unless a marker
+    # could be formed across the fragments.
+    def assemble_variants(self, frags, rows, normalized=False):
+        if normalized:
+            splits = [frag.split_values() for frag in frags]
+            if separable(splits):
+                pieces = [split[0] for split in splits]
+                return [assemble([p[i] for p, i in zip(pieces, row)]) for row in rows]
+        values = [frag.values for frag in frags]
+        variants = ["".join(v[i] for v, i in zip(values, row)) for row in rows]
+        if normalized:
+            variants = [self.normalize_variation(v) for v in variants]
+        return variants
+
+    # the number of variants in the ordered product of the fragments
+    def num_variants(self, frags):
+        product = 1
+        for frag in frags:
+            product *= len(frag)
+        return product
+
+    # the variant at position index of the ordered product of the fragments (the last fragment changes fastest)
+    def variant_of_index(self, frags, index, normalized=False):
+        digits = mixed_radix_digits(index, [len(frag) for frag in frags])
+        return self.assemble_variants(frags, [digits], normalized)[0]
+
+    # Random access to the variants of an utterance. The fragment pools are derived from the master seed,
+    # so the k-th variant is the same in every run with the same seed and jobs can split the variant space
+    # by index ranges.
+    def utterance_fragmentations(self, utter, max_variants=100):
+        definitions = {}
+        snapshot = self.snapshot
+        return self.get_utter_fragmentations(self.change_to_logical_rules(utter, definitions, snapshot),
+                                             max_variants, definitions, snapshot)
+
+    def variant_count(self, utter, max_variants=100):
+        return self.num_variants(self.utterance_fragmentations(utter, max_variants))
+
+    def variant_at(self, utter, k, max_variants=100):
+        frags = self.utterance_fragmentations(utter, max_variants)
+        n = self.num_variants(frags)
+        if k < 0:
+            k += n
+        if k < 0 or k >= n:
+            raise IndexError(f'Variant {k} out of range, the utterance has {n} variants')
+        return self.variant_of_index(frags, k, normalized=True)
+
+    def page(self, utter, start, stop, max_variants=100):
+        frags = self.utterance_fragmentations(utter, max_variants)
+        stop = min(stop, self.num_variants(frags))
+        sizes = [len(frag) for frag in frags]
+        return self.assemble_variants(frags, [mixed_radix_digits(k, sizes) for k in range(max(start, 0), stop)],
+                                      normalized=True)
 
     def normalize_variation(self, v):
-        v = re.sub("@@\w+@@", " ", v)  # Remove @@x@@ notations
-        v = re.sub("\s{2,}", " ", v)  # double+ whitespace
-        v = v.strip()
-        return v
+        return normalize_variation(v)
 
     def normalize_utterance(self, s):
-        s = s.lower()
-        s = s.strip()
-        return s
+        return normalize_utterance(s)
 
     def no_logical_rules(self, utter):
         match = [re.findall('<<[A-Za-z0-9_]+>>', u) for u in utter]
@@ -162,7 +570,7 @@ class Augmentor:
         alternatives = []
         for utter in utters:
             for _ in re.finditer(logical_rule, utter):
-                exp = self.expressions_df.iloc[row_index].expression
+                exp = self.rules.expressions[row_index]
                 for exp_match in re.finditer('[^<<]([ A-Za-z0-9_]+)', exp):
                     e = exp[exp_match.start() + 1: exp_match.end()]
                     if 'QQQ' not in e:
@@ -170,3 +578,49 @@ class Augmentor:
                         alternatives.append(x)
 
         return alternatives
+
+
+# a stable 64 bit key of a text, python's hash() is salted per process
+def stable_key(text):
+    return int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+
+
+class RulesSnapshot:
+    # one version of the rules: the registry, its matcher, the output only rules and the cleaned patterns
+    # of the matcher. A snapshot is not changed once it is published, an update publishes a new one.
+    def __init__(self, rules, rule_matcher, output_only_expr, clean_patterns):
+        self.rules = rules
+        self.rule_matcher = rule_matcher
+        self.output_only_expr = output_only_expr
+        self.clean_patterns = clean_patterns
+
+
+class RulesWatcher(threading.Thread):
+    def __init__(self, augmentor, interval=1.0, on_error=None):
+        super().__init__(daemon=True)
+        self.augmentor = augmentor
+        self.interval = interval
+        self.on_error = on_error
+        self.stopped = threading.Event()
+        self.mtimes = self.modification_times()
+
+    def modification_times(self):
+        fnames = self.augmentor.expressions_fname
+        if type(fnames) != list:
+            fnames = [fnames]
+        return [os.stat(fname).st_mtime_ns for fname in fnames]
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                mtimes = self.modification_times()
+                if mtimes != self.mtimes:
+                    self.mtimes = mtimes
+                    self.augmentor.reload_rules()
+            except Exception as e:
+                # a rule file that is being edited may be invalid for a moment, the next change reloads it
+                if self.on_error is not None:
+                    self.on_error(e)
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,167 @@
+import re
+import zlib
+
+REFERENCE_REGEX = '<<[A-Za-z0-9_]+>>'
+# a numbered back reference, or an escaped backslash that must be skipped over
+BACKREF_REGEX = re.compile(r'\\(\\|[1-9][0-9]?)')
+# a rule with back references or named groups of its own is matched in a chunk of its own
+ISOLATED_REGEX = re.compile(r'\\[1-9]|\(\?P[<=]')
+
+
+class RuleMatcher:
+    # Rewrites text into <<rule>> references in a single scan. The rules are compiled into chunks, each
+    # one alternation of named groups ordered by priority next to an alternative that consumes
+    # existing references so that rule names are never matched inside them. The reference alternative
+    # is the unnamed group 1 of every chunk, so it cannot collide with the group names of a rule.
+    # A matcher rebuilt from an earlier one reuses the chunks whose rules did not change. The chunks of
+    # add_rules end after the rules whose name hashes to 0 modulo tail_size, so a changed rule changes
+    # only its own chunk.
+    # A chunk is kept as its pattern source and group names, which can be saved (see state) and given
+    # to a new matcher with from_state. The sources are compiled when the matcher first rewrites.
+
+    def __init__(self, tail_size=256, previous=None):
+        self.tail_size = tail_size
+        self.chunks = []
+        self.scanners = None
+        self.previous_chunks = {} if previous is None else previous.compiled
+        self.previous_empty = {} if previous is None else previous.matches_empty
+        self.patterns = {} if previous is None else dict(previous.patterns)
+        self.compiled = {}
+        self.matches_empty = {}
+
+    # an empty matcher that reuses the chunk sources and empty string checks of state, as the previous
+    # matcher of the one that is built next
+    @classmethod
+    def from_state(cls, state):
+        matcher = cls()
+        matcher.compiled, matcher.matches_empty = state
+        return matcher
+
+    # the chunk sources and empty string checks of the rules, see from_state
+    def state(self):
+        return self.compiled, self.matches_empty
+
+    def pattern(self, source):
+        pattern = self.patterns.get(source)
+        if pattern is None:
+            pattern = self.patterns[source] = re.compile(source)
+        return pattern
+
+    def add_rules(self, rules):
+        chunk = []
+        for name, pattern in rules:
+            chunk.append((name, pattern))
+            if zlib.crc32(name.encode()) % self.tail_size == 0 or len(chunk) >= 4 * self.tail_size:
+                self.chunks.extend(self.compile_chunks(chunk))
+                chunk = []
+        self.chunks.extend(self.compile_chunks(chunk))
+        self.scanners = None
+        live = set(source for source, _ in self.compiled.values())
+        self.patterns = {source: pattern for source, pattern in self.patterns.items() if source in live}
+
+    def matches_empty_string(self, name, pattern):
+        empty = self.matches_empty.get(pattern)
+        if empty is None:
+            empty = self.previous_empty.get(pattern)
+            if empty is None:
+                empty = RuleMatcher.compile_rule(name, pattern).fullmatch('') is not None
+            self.matches_empty[pattern] = empty
+        return empty
+
+    # The text is scanned once over all the chunks: the leftmost match is replaced, and of the matches
+    # at the same position the one of the earlier rule, as if all the rules were one alternation. The
+    # result does not depend on how the rules are split into chunks.
+    def rewrite(self, utter):
+        if self.scanners is None:
+            self.scanners = [(self.pattern(source), names) for source, names in self.chunks]
+        chunks = self.scanners
+        found = [pattern.search(utter) for pattern, _ in chunks]
+        out = []
+        pos = 0
+        while True:
+            best = None
+            for i in range(len(chunks)):
+                m = found[i]
+                if m is not None and m.start() < pos:
+                    m = found[i] = chunks[i][0].search(utter, pos)  # overlapped by the last replacement
+                if m is not None and (best is None or m.start() < found[best].start()):
+                    best = i
+            if best is None:
+                break
+            m = found[best]
+            names = chunks[best][1]
+            out.append(utter[pos:m.start()])
+            out.append(m.group(0) if m.lastindex == 1 else names.get(m.lastgroup, names.get(None)))
+            pos = m.end()
+        out.append(utter[pos:])
+        return ''.join(out)
+
+    def compile_chunks(self, rules):
+        chunks = []
+        combined = []
+        for name, pattern in rules:
+            if ISOLATED_REGEX.search(pattern):
+                # back references are numbered and group names unique inside the pattern, keep such rules
+                # in their own chunk
+                if combined:
+                    chunks.append(self.compile_combined(combined))
+                    combined = []
+                if not self.matches_empty_string(name, pattern):
+                    chunks.append(self.compile_combined([(name, pattern)], single=True))
+            else:
+                combined.append((name, pattern))
+        if combined:
+            chunks.append(self.compile_combined(combined))
+        return chunks
+
+    def compile_combined(self, rules, single=False):
+        key = tuple(rules)
+        chunk = self.compiled.get(key)
+        if chunk is None:
+            chunk = self.previous_chunks.get(key)
+            if chunk is None:
+                pattern, names = RuleMatcher.isolate(*rules[0]) if single else RuleMatcher.combine(rules)
+                self.patterns[pattern.pattern] = pattern
+                chunk = (pattern.pattern, names)
+            self.compiled[key] = chunk
+        return chunk
+
+    # a rule with back references or named groups on its own, behind the reference alternative, which
+    # takes group 1
+    @staticmethod
+    def isolate(name, pattern):
+        shifted = BACKREF_REGEX.sub(lambda m: m.group(0) if m.group(1) == '\\' else f'\\{int(m.group(1)) + 1}',
+                                    pattern)
+        RuleMatcher.compile_rule(name, pattern)
+        return RuleMatcher.compile_rule(name, f'({REFERENCE_REGEX})|(?:{shifted})(?!>)'), {None: name}
+
+    # One pattern of the rules in priority order. A rule that matches the empty string would rewrite
+    # every position and is left out. The combined pattern matches the empty string at the first such
+    # rule, so they are found with one match of the combined pattern each instead of one compile per rule.
+    @staticmethod
+    def combine(rules):
+        rules = list(rules)
+        while True:
+            names = {}
+            alternatives = [f'({REFERENCE_REGEX})']
+            for name, pattern in rules:
+                group = f'r{len(names)}'
+                names[group] = name
+                alternatives.append(f'(?P<{group}>{pattern})(?!>)')
+            try:
+                combined = re.compile('|'.join(alternatives))
+            except re.error:
+                for name, pattern in rules:
+                    RuleMatcher.compile_rule(name, pattern)
+                raise
+            empty = combined.match('')
+            if empty is None:
+                return combined, names
+            del rules[int(empty.lastgroup[1:])]
+
+    @staticmethod
+    def compile_rule(name, pattern):
+        try:
+            return re.compile(pattern)
+        except re.error as e:
+            raise Exception(f'Error in expression of rule {name}: {pattern} ({e})')
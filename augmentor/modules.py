@@ -1,15 +1,18 @@
 import numpy as np
 
+from augmentor.normalize import piece_key, split_values
+from augmentor.program import Program
+
 TRIM_MAX_REPEAT = 5
 
 
 class Leaf:
+    # the options are a str when every option is a single character (a character class, one codepoint
+    # per option) and a tuple of strings otherwise
+    __slots__ = ('options',)
 
-    def __init__(self):
-        self.options = []
-
-    def add_option(self, option):
-        self.options.append(str(option))
+    def __init__(self, options=()):
+        self.options = options
 
     def num_options(self):
         return len(self.options)
@@ -22,38 +25,140 @@ class Leaf:
 
 
 class InnerNode:
+    __slots__ = ('child_id', 'brother_id', 'leaf_id', 'type_str', 'type_specific_info')
 
-    def __init__(self):
+    def __init__(self, type_str='', type_specific_info=()):
         self.child_id = -1
         self.brother_id = -1
         self.leaf_id = -1
-        self.type_str = ''
-        self.type_specific_info = []
-        self.traverse_info = {}
+        self.type_str = type_str
+        self.type_specific_info = type_specific_info
 
     def print(self, inner_node_id=None):
         if inner_node_id is None:
             print('@@@node son:', self.child_id, ' brother: ', self.brother_id, ' leaf: ', self.leaf_id, ' ',
-                  self.type_str, ' auxiliary: ', self.type_specific_info)
+                  self.type_str, ' auxiliary: ', list(self.type_specific_info))
         else:
             print('@@@node: ', inner_node_id, ' son:', self.child_id, ' brother: ', self.brother_id, ' leaf: ',
-                  self.leaf_id, ' ', self.type_str, ' auxiliary: ', self.type_specific_info)
+                  self.leaf_id, ' ', self.type_str, ' auxiliary: ', list(self.type_specific_info))
         pass
 
 
+class WeightedChoice:
+    # unique values with an alias table (Vose) so that a weighted draw costs O(1)
+
+    def __init__(self, values, weights=None):
+        n = len(values)
+        if n == 0:
+            raise Exception('Empty weighted choice')
+        self.values = list(values)
+        self.split = None
+        self.merged = None
+        if weights is None:
+            weights = np.ones(n)
+        weights = np.asarray(weights, dtype=np.float64)
+        self.weights = weights / weights.sum()
+        scaled = weights * (n / weights.sum())
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+        small = [i for i in range(n) if scaled[i] < 1.0]
+        large = [i for i in range(n) if scaled[i] >= 1.0]
+        while small and large:
+            s, g = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = g
+            scaled[g] = (scaled[g] + scaled[s]) - 1.0
+            if scaled[g] < 1.0:
+                small.append(g)
+            else:
+                large.append(g)
+
+    def __len__(self):
+        return len(self.values)
+
+    def draw_indices(self, size, rng=None):
+        if len(self.values) == 1:
+            return np.zeros(size, dtype=int)
+        if rng is None:
+            rng = np.random.default_rng()
+        k = rng.integers(0, len(self.values), size)
+        return np.where(rng.random(size) < self.prob[k], k, self.alias[k])
+
+    # the values split for normalized assembly (see normalize.split_values), computed on first use
+    def split_values(self):
+        if self.split is None:
+            self.split = split_values(self.values)
+        return self.split
+
+    # The choice with the values that assemble into the same normalized variants merged into the first
+    # of them, their weights summed, computed on first use. Only valid when the fragments are separable.
+    def merge_normalized(self):
+        if self.merged is None:
+            first = {}
+            for i, piece in enumerate(self.split_values()[0]):
+                first.setdefault(piece_key(piece), []).append(i)
+            if len(first) == len(self.values):
+                self.merged = self
+            else:
+                groups = list(first.values())
+                self.merged = WeightedChoice([self.values[g[0]] for g in groups],
+                                             [self.weights[g].sum() for g in groups])
+        return self.merged
+
+
+# m distinct integers drawn uniformly from range(n) with Floyd's algorithm, in random order
+def sample_distinct(n, m, rng):
+    if m >= n:
+        return rng.permutation(n).tolist()
+    chosen = set()
+    for j in range(n - m, n):
+        t = random_below(j + 1, rng)
+        chosen.add(j if t in chosen else t)
+    chosen = list(chosen)
+    return [chosen[i] for i in rng.permutation(len(chosen))]
+
+
+# uniform integer in range(n), also for n beyond the int64 range of rng.integers
+def random_below(n, rng):
+    if n < 2 ** 63:
+        return int(rng.integers(0, n))
+    n_bytes = (n.bit_length() + 7) // 8
+    while True:
+        x = int.from_bytes(rng.bytes(n_bytes), 'little') >> (8 * n_bytes - n.bit_length())
+        if x < n:
+            return x
+
+
+# the digits of index in the mixed radix of sizes, the last digit is the fastest changing
+def mixed_radix_digits(index, sizes):
+    digits = [0] * len(sizes)
+    for i in range(len(sizes) - 1, -1, -1):
+        index, digits[i] = divmod(index, sizes[i])
+    return digits
+
+
 class Tree:
+    __slots__ = ('inner_nodes', 'leaves', 'leaf_ids', 'group_to_node_id', 'program')
+
     def __init__(self):
         self.inner_nodes = []
         self.leaves = []
+        self.leaf_ids = {}
         self.group_to_node_id = {}
-        self.traverse_output = []
-        self.node_ids_in_traverse = []
+        self.program = None
 
+    # leaves are shared by all the nodes with the same options, a leaf must not be changed once added
     def add_leaf(self, leaf):
-        self.leaves.append(leaf)
-        return len(self.leaves) - 1
+        self.program = None
+        leaf_id = self.leaf_ids.get(leaf.options)
+        if leaf_id is None:
+            leaf_id = len(self.leaves)
+            self.leaves.append(leaf)
+            self.leaf_ids[leaf.options] = leaf_id
+        return leaf_id
 
     def add_inner_node(self, node, parent_id, brother_id):
+        self.program = None
         self.inner_nodes.append(node)
         inner_node_id = len(self.inner_nodes) - 1
         self.update_father(inner_node_id, parent_id)
@@ -68,10 +173,6 @@ class Tree:
         if brother_id != -1:
             self.inner_nodes[brother_id].brother_id = node_id
 
-    def clear_traverse_info(self):
-        for seg in self.inner_nodes:
-            seg.traverse_info = {}
-
     def print(self):
         print('@@@tree nSeg: ', len(self.inner_nodes), ' nLeaves: ', len(self.leaves),
               ' nGroups: ', len(self.group_to_node_id))
@@ -80,83 +181,21 @@ class Tree:
         for i in range(len(self.inner_nodes)):
             self.inner_nodes[i].print(i)
 
-    def traverse_tree(self, do_print=False, seed=1108):
+    # flattens the tree into an array-backed program, cached until the tree is modified
+    def compile(self):
+        if self.program is None:
+            self.program = Program.from_tree(self)
+        return self.program
+
+    # one sample of the tree, drawn from rng or else from a generator seeded with seed
+    def traverse_tree(self, do_print=False, seed=1108, rng=None):
         if len(self.inner_nodes) == 0:
             return []
-        if seed is not None:
-            np.random.seed(seed)
-        self.node_ids_in_traverse = []
-        self.traverse_output = []
-        self.clear_traverse_info()
-        self.traverse(node_id=0, do_print=do_print)
-        return self.traverse_output
-
-    def traverse(self, node_id, do_print):
-        assert (node_id is not None)  # this means something was not updated
-        curr = self.inner_nodes[node_id]
-
-        if do_print:
-            curr.print()
-        if curr.leaf_id != -1:
-            options = self.leaves[curr.leaf_id].options
-            n = len(options)
-            if n == 0:
-                raise Exception(f'Invalid leaf {curr.leaf_id} node: {node_id}')
-            if n == 1:
-                x = options[0]
-            else:
-                x = options[np.random.randint(0, n, 1)[0]]
-            self.traverse_output.extend(x)
-        else:
-            if curr.type_str == 'GROUPREF':
-                group_id = curr.type_specific_info[0]
-                node_id = self.group_to_node_id[group_id]
-                str_to_copy = self.inner_nodes[node_id].traverse_info['str_value']
-                self.traverse_output.extend(str_to_copy)
-
-            elif curr.type_str == 'GROUP':  # this is subpatteren
-                start_of_str = len(self.traverse_output)
-                self.traverse(curr.child_id, do_print)
-                curr.traverse_info['str_value'] = self.traverse_output[start_of_str:]
-            elif curr.type_str == 'MAX_REPEAT':
-                if len(curr.type_specific_info[0]) == 0:
-                    options_weights_lst = [1 for i in
-                                           list(range(curr.type_specific_info[1], curr.type_specific_info[2]))]
-                else:
-                    options_weights_lst = curr.type_specific_info[0]
-                helper_id = random_according_to_weights(options_weights_lst)
-                num_repeats = curr.type_specific_info[1] + helper_id  # you draw an offset
-                if do_print:
-                    do_print('@@@ num_repeats: ', num_repeats, ' weights: ', curr.type_specific_info[2])
-                for i in range(num_repeats):
-                    self.traverse(curr.child_id, do_print)
-            elif curr.type_str == 'BRANCH':
-                # curr.type_specific_info[0] contains the drawing weight for each option
-                n = len(curr.type_specific_info) - 1
-                if n == 1:
-                    child_id = curr.type_specific_info[1]
-                else:
-                    helper_id = random_according_to_weights(curr.type_specific_info[0])
-                    child_id = curr.type_specific_info[1 + helper_id]
-                    if do_print:
-                        do_print('@@@ branch_id: ', child_id, ' weights: ', curr.type_specific_info[0])
-                self.traverse(child_id, do_print)
-            else:
-                if curr.type_str != 'EXPRESSION':
-                    raise Exception(f'Wrong type {node_id}')
-                else:
-                    self.traverse(curr.child_id, do_print)
-
-        if curr.brother_id != -1:
-            self.traverse(curr.brother_id, do_print)
-        return
-
-
-def random_according_to_weights(weights):
-    x = np.cumsum(np.array(weights, dtype=int))
-    max_index = len(weights) - 1
-    high = x[max_index]
-    rand_int = np.random.randint(0, high)
-    for i in range(len(weights)):
-        if rand_int < x[i]:
-            return i
+        if rng is None:
+            rng = np.random.default_rng(seed)
+        return self.compile().sample(do_print, rng)
+
+    def sample_batch(self, n, rng=None):
+        if len(self.inner_nodes) == 0:
+            return [''] * n
+        return self.compile().sample_batch(n, rng)
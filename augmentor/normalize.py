@@ -0,0 +1,78 @@
+import re
+
+MARKER_REGEX = re.compile(r'@@\w+@@')
+WHITESPACE_RUN_REGEX = re.compile(r'\s{2,}')
+LEADING_WORD_REGEX = re.compile(r'[\w@]*')
+TRAILING_WORD_REGEX = re.compile(r'[\w@]*\Z')
+
+# token of a whitespace run of two or more characters, which normalizes to a single space
+LONG_RUN = '  '
+
+
+def normalize_variation(v):
+    v = MARKER_REGEX.sub(' ', v)  # Remove @@x@@ notations
+    v = WHITESPACE_RUN_REGEX.sub(' ', v)  # double+ whitespace
+    v = v.strip()
+    return v
+
+
+# Splits every value of a fragment into (lead, core, trail): the core is the value normalized on its
+# own and lead/trail are the tokens of its boundary whitespace runs (the run itself when it is a
+# single character, LONG_RUN otherwise). A value that is all whitespace has an empty core and its
+# token as lead.
+# A marker can also be formed across values, "x@@" + "b@@", which needs an @ in the word characters
+# at the end of one value and in those at the start of a later one. Returns the pieces with whether
+# any value has an @ there at its start and at its end.
+def split_values(values):
+    pieces = []
+    at_start = at_end = False
+    for value in values:
+        if '@' in value:
+            at_start = at_start or '@' in LEADING_WORD_REGEX.match(value).group()
+            at_end = at_end or '@' in TRAILING_WORD_REGEX.search(value).group()
+        v = MARKER_REGEX.sub(' ', value)
+        core = v.strip()
+        if not core:
+            pieces.append((run_token(v), '', ''))
+            continue
+        start = len(v) - len(v.lstrip())
+        lead, trail = v[:start], v[start + len(core):]
+        pieces.append((run_token(lead), WHITESPACE_RUN_REGEX.sub(' ', core), run_token(trail)))
+    return pieces, at_start, at_end
+
+
+# whether the fragments can be normalized one by one, i.e. no marker can be formed across them
+def separable(splits):
+    at_end = False
+    for _, frag_at_start, frag_at_end in splits:
+        if at_end and frag_at_start:
+            return False
+        at_end = at_end or frag_at_end
+    return True
+
+
+# The assembly key of a split value. A single space and LONG_RUN give the same separator in assemble,
+# so values with equal keys assemble into the same variant next to any other values.
+def piece_key(piece):
+    lead, core, trail = piece
+    return ' ' if lead == LONG_RUN else lead, core, ' ' if trail == LONG_RUN else trail
+
+
+def run_token(run):
+    return run if len(run) < 2 else LONG_RUN
+
+
+# joins split values into the normalized variant, equal to normalize_variation of the joined raw values
+def assemble(pieces):
+    out = []
+    ws = ''
+    for lead, core, trail in pieces:
+        if lead:
+            ws = lead if not ws else LONG_RUN
+        if not core:
+            continue
+        if ws and out:
+            out.append(' ' if len(ws) > 1 else ws)
+        out.append(core)
+        ws = trail
+    return ''.join(out)
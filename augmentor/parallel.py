@@ -0,0 +1,58 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+_worker_augmentor = None
+
+
+# runs once in every worker process, the rules are loaded from the already resolved table
+def _init_worker(augmentor_cls, state):
+    global _worker_augmentor
+    expressions_df, compiled_programs, kwargs = state
+    _worker_augmentor = augmentor_cls(None, [], resolved_expressions=expressions_df, **kwargs)
+    _worker_augmentor.compiled_programs = compiled_programs
+
+
+# the stats collected by the worker for this utterance are sent back with its variations
+def _variations_of(utterance, max_variants, unique):
+    variations = _worker_augmentor.get_variations_list(utterance, max_variants, unique=unique, normalized=True)
+    stats = _worker_augmentor.stats
+    if stats is None:
+        return utterance, variations, None
+    state = stats.state()
+    stats.reset()
+    return utterance, variations, state
+
+
+# Yields (utterance, [variants]) computed by a pool of `jobs` processes. With ordered=True the results
+# come back in the input order, otherwise as soon as they complete. At most `window` utterances are in
+# flight at a time so the input can be a lazy stream.
+def iter_parallel_variations(augmentor, utterances, max_variants, jobs, ordered=True, window=None, unique=False):
+    if window is None:
+        window = 4 * jobs
+    state = (augmentor.worker_state(), augmentor.compiled_programs, augmentor.worker_kwargs())
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(type(augmentor), state)) as executor:
+        pending = deque()
+        for utterance in utterances:
+            pending.append(executor.submit(_variations_of, utterance, max_variants, unique))
+            yield from _merge_stats(augmentor, _collect(pending, ordered, window - 1))
+        yield from _merge_stats(augmentor, _collect(pending, ordered, 0))
+
+
+def _merge_stats(augmentor, results):
+    for utterance, variations, stats in results:
+        if stats is not None:
+            augmentor.stats.merge(stats)
+        yield utterance, variations
+
+
+# yields finished results until at most `keep` futures are pending
+def _collect(pending, ordered, keep):
+    while len(pending) > keep:
+        if ordered:
+            yield pending.popleft().result()
+        else:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+                yield future.result()
@@ -0,0 +1,452 @@
+from types import GeneratorType
+
+from augmentor.modules import Tree, TRIM_MAX_REPEAT, InnerNode, Leaf
+
+# character class tables, one codepoint per option in codepoint order, built once and shared by all
+# the parsed trees
+ALL_CHARS = ''.join(chr(x) for x in range(32, 127))
+DIGITS = ''.join(chr(x) for x in range(48, 58))
+NOT_DIGITS = ''.join(c for c in ALL_CHARS if c not in DIGITS)
+
+SMALL = ''.join(chr(x) for x in range(97, 123))
+CAPITAL = ''.join(chr(x) for x in range(65, 91))
+
+LETTERS = SMALL + CAPITAL
+NOT_LETTERS = ''.join(c for c in ALL_CHARS if c not in LETTERS)
+
+ALNUM = DIGITS + LETTERS  # this is called word
+NOT_ALNUM = ''.join(c for c in ALL_CHARS if c not in ALNUM and c != '_')  # _ is a word character for \W
+
+WSPACE = ' \t\n\r\f\v'
+NOT_WSPACE = ''.join(c for c in ALL_CHARS if c not in WSPACE)
+
+ALL_CHARS_WITH_WSPACE = ALL_CHARS + WSPACE
+ANY_CHAR = ''.join(c for c in ALL_CHARS_WITH_WSPACE if c != '\n')
+
+AT_PARAMS = {
+    'AT_BEGINNING': '@@^@@ ',
+    'AT_END': ' @@$@@',
+    'AT_BOUNDARY': ' @@b@@ ',
+    'AT_NON_BOUNDARY': '@@B@@ ',
+}
+
+CATEGORY_PARAMS = {
+    'd': DIGITS,
+    'D': NOT_DIGITS,
+    'w': ALNUM,
+    'W': NOT_ALNUM,
+    's': WSPACE,
+    'S': NOT_WSPACE,
+}
+
+AT_ESCAPES = {
+    'b': 'AT_BOUNDARY',
+    'B': 'AT_NON_BOUNDARY',
+    'A': 'AT_BEGINNING',
+    'Z': 'AT_END',
+}
+
+CHAR_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'f': '\f', 'v': '\v', 'a': '\a', '0': '\0'}
+
+NAME_CHARS = set(SMALL + CAPITAL + DIGITS + '_')
+
+# character classes seen so far, equal classes of all the trees share one string
+CHARSETS = {}
+
+
+def intern_charset(chars):
+    return CHARSETS.setdefault(chars, chars)
+
+
+class DSLParser:
+    # Single pass parser of the augmentation DSL: regular expressions with
+    #   alternative ~N        drawing weight of an alternative
+    #   x{2,4}<1,5,1>         drawing weights of the number of repeats
+    #   alternative %         output only alternative, never generated
+    #   (name:...)            inline definition, a named capturing group
+    #   <<name>>              rule reference, must be resolved before parsing
+    # The expression is parsed into a small AST with an explicit stack and then emitted into a Tree of
+    # InnerNode/Leaf with the weights already attached.
+
+    def parse(self, expression):
+        return self.build_tree(self.parse_ast(expression))
+
+    # AST items: ('LIT', text), ('IN', options), ('AT', text), ('REF', group_id),
+    # ('GROUP', group_id, alt), ('REPEAT', min, max, weights, item) and ('ALT', [items...], weights)
+    def parse_ast(self, expression):
+        pos = 0
+        n = len(expression)
+        group_counter = 0
+        closed_groups = set()
+        # frames of the open groups: (group_id, alternatives, weights, output_only, items, current_weight)
+        stack = []
+        alternatives, weights, output_only, items = [], [], [], []
+        current_weight = None
+        group_id = None
+
+        while pos < n:
+            c = expression[pos]
+            if c == '(':
+                if expression.startswith('(?:', pos):
+                    new_group = None
+                    pos += 3
+                elif expression.startswith('(?P<', pos):
+                    end = expression.find('>', pos)
+                    if end == -1:
+                        raise self.error(expression, pos, 'unterminated group name')
+                    group_counter += 1
+                    new_group = str(group_counter)
+                    pos = end + 1
+                elif expression.startswith('(?', pos):
+                    raise self.error(expression, pos, 'unsupported group construct')
+                else:
+                    group_counter += 1
+                    new_group = str(group_counter)
+                    pos += 1
+                    name_end = pos
+                    while name_end < n and expression[name_end] in NAME_CHARS:
+                        name_end += 1
+                    if name_end > pos and name_end < n and expression[name_end] == ':':
+                        pos = name_end + 1  # inline definition, (name:...)
+                stack.append((group_id, alternatives, weights, output_only, items, current_weight))
+                group_id, alternatives, weights, output_only, items, current_weight = new_group, [], [], [], [], None
+                continue
+
+            if c == '|' or c == ')':
+                items, is_output_only = self.pop_output_only_mark(items)
+                alternatives.append(items)
+                weights.append(1 if current_weight is None else current_weight)
+                output_only.append(is_output_only)
+                items, current_weight = [], None
+                if c == '|':
+                    pos += 1
+                    continue
+                if not stack:
+                    raise self.error(expression, pos, 'unbalanced parenthesis')
+                alt = self.make_alternation(expression, pos, alternatives, weights, output_only)
+                closed_id = group_id
+                group_id, alternatives, weights, output_only, items, current_weight = stack.pop()
+                if closed_id is None:
+                    items.append(alt)
+                else:
+                    closed_groups.add(closed_id)
+                    items.append(('GROUP', closed_id, alt))
+                pos += 1
+                continue
+
+            if c in '*+?{':
+                quantifier = self.read_quantifier(expression, pos)
+                if quantifier is None:
+                    items.append(('LIT', c))
+                    pos += 1
+                    continue
+                min_repeat, max_repeat, pos = quantifier
+                if not items:
+                    raise self.error(expression, pos, 'nothing to repeat')
+                item = items.pop()
+                if item[0] == 'LIT' and len(item[1]) > 1:
+                    items.append(('LIT', item[1][:-1]))
+                    item = ('LIT', item[1][-1])
+                if max_repeat is None:
+                    max_repeat = max(TRIM_MAX_REPEAT, min_repeat + 1)
+                repeat_weights = []
+                if pos < n and expression[pos] == '<':
+                    repeat_weights, pos = self.read_repeat_weights(expression, pos, max_repeat + 1 - min_repeat)
+                items.append(('REPEAT', min_repeat, max_repeat, repeat_weights, item))
+                continue
+
+            if c == '~' and pos + 1 < n and expression[pos + 1].isdigit():
+                end = pos + 1
+                while end < n and expression[end].isdigit():
+                    end += 1
+                current_weight = int(expression[pos + 1:end])
+                pos = end
+                continue
+
+            if c == '<' and expression.startswith('<<', pos):
+                end = expression.find('>>', pos)
+                if end != -1 and all(x in NAME_CHARS for x in expression[pos + 2:end]):
+                    raise self.error(expression, pos, f'unresolved reference {expression[pos:end + 2]}')
+
+            if c == '[':
+                options, pos = self.read_class(expression, pos)
+                items.append(('IN', options))
+                continue
+
+            if c == '\\':
+                item, pos = self.read_escape(expression, pos)
+                if item[0] == 'REF' and item[1] not in closed_groups:
+                    raise Exception(f'Non-existing group: {item[1]}')
+                self.append_item(items, item)
+                continue
+
+            if c == '.':
+                items.append(('IN', ANY_CHAR))
+            elif c == '^':
+                items.append(('AT', AT_PARAMS['AT_BEGINNING']))
+            elif c == '$':
+                items.append(('AT', AT_PARAMS['AT_END']))
+            else:
+                self.append_item(items, ('LIT', c))
+            pos += 1
+
+        if stack:
+            raise self.error(expression, n, 'missing closing parenthesis')
+        items, is_output_only = self.pop_output_only_mark(items)
+        alternatives.append(items)
+        weights.append(1 if current_weight is None else current_weight)
+        output_only.append(is_output_only)
+        return self.make_alternation(expression, n, alternatives, weights, output_only)
+
+    @staticmethod
+    def append_item(items, item):
+        # consecutive literals are merged into one leaf
+        if item[0] == 'LIT' and items and items[-1][0] == 'LIT':
+            items[-1] = ('LIT', items[-1][1] + item[1])
+        else:
+            items.append(item)
+
+    @staticmethod
+    def pop_output_only_mark(items):
+        if items and items[-1][0] == 'LIT' and items[-1][1].endswith('%'):
+            text = items[-1][1][:-1]
+            return (items[:-1] + [('LIT', text)]) if text else items[:-1], True
+        return items, False
+
+    def make_alternation(self, expression, pos, alternatives, weights, output_only):
+        if any(output_only):
+            kept = [(a, w) for a, w, o in zip(alternatives, weights, output_only) if not o]
+            if not kept:
+                raise self.error(expression, pos, 'all the alternatives are output only')
+            alternatives, weights = [a for a, _ in kept], [w for _, w in kept]
+        if len(alternatives) == 1:
+            return ('ALT', alternatives, [1])
+        return ('ALT', alternatives, weights)
+
+    @staticmethod
+    def read_quantifier(expression, pos):
+        c = expression[pos]
+        if c == '*':
+            min_repeat, max_repeat, pos = 0, None, pos + 1
+        elif c == '+':
+            min_repeat, max_repeat, pos = 1, None, pos + 1
+        elif c == '?':
+            min_repeat, max_repeat, pos = 0, 1, pos + 1
+        else:
+            end = expression.find('}', pos)
+            if end == -1:
+                return None
+            body = expression[pos + 1:end]
+            parts = body.split(',')
+            if len(parts) > 2 or not all(p.isdigit() or p == '' for p in parts) or body in ('', ','):
+                return None  # not a quantifier, a literal {
+            min_repeat = int(parts[0]) if parts[0] else 0
+            if len(parts) == 1:
+                max_repeat = min_repeat
+            else:
+                max_repeat = int(parts[1]) if parts[1] else None
+            pos = end + 1
+        if pos < len(expression) and expression[pos] == '?':
+            pos += 1  # lazy repeats are sampled like greedy ones
+        return min_repeat, max_repeat, pos
+
+    def read_repeat_weights(self, expression, pos, n_options):
+        end = expression.find('>', pos)
+        body = expression[pos + 1:end] if end != -1 else ''
+        if end == -1 or not all(x.isdigit() or x == ',' for x in body) or not any(x.isdigit() for x in body):
+            return [], pos  # a literal <
+        values = [int(x) for x in body.split(',') if len(x) > 0][:n_options]
+        values.extend([1] * (n_options - len(values)))
+        return values, end + 1
+
+    def read_class(self, expression, pos):
+        start = pos
+        pos += 1
+        negate = False
+        if pos < len(expression) and expression[pos] == '^':
+            negate = True
+            pos += 1
+        chars = []
+        first = True
+        while True:
+            if pos >= len(expression):
+                raise self.error(expression, start, 'unterminated character set')
+            c = expression[pos]
+            if c == ']' and not first:
+                pos += 1
+                break
+            first = False
+            if c == '\\':
+                item, pos = self.read_escape(expression, pos, in_class=True)
+                if item[0] == 'IN':
+                    chars.extend(item[1])
+                    continue
+                c = item[1]
+            else:
+                pos += 1
+            if pos + 1 < len(expression) and expression[pos] == '-' and expression[pos + 1] != ']':
+                if expression[pos + 1] == '\\':
+                    item, end_pos = self.read_escape(expression, pos + 1, in_class=True)
+                    if item[0] != 'LIT':
+                        raise self.error(expression, pos, 'bad character range')
+                    hi = item[1]
+                else:
+                    hi, end_pos = expression[pos + 1], pos + 2
+                if ord(hi) < ord(c):
+                    raise self.error(expression, pos, 'bad character range')
+                chars.extend(chr(x) for x in range(ord(c), ord(hi) + 1))
+                pos = end_pos
+            else:
+                chars.append(c)
+
+        chars = ''.join(dict.fromkeys(chars))
+        if negate:
+            chars = ''.join(c for c in ALL_CHARS_WITH_WSPACE if c not in chars)
+        if not chars:
+            raise self.error(expression, start, 'empty character set')
+        return intern_charset(chars), pos
+
+    def read_escape(self, expression, pos, in_class=False):
+        if pos + 1 >= len(expression):
+            raise self.error(expression, pos, 'bad escape (end of pattern)')
+        c = expression[pos + 1]
+        if c in CATEGORY_PARAMS:
+            return ('IN', CATEGORY_PARAMS[c]), pos + 2
+        if c in CHAR_ESCAPES:
+            return ('LIT', CHAR_ESCAPES[c]), pos + 2
+        if not in_class and c in AT_ESCAPES:
+            return ('AT', AT_PARAMS[AT_ESCAPES[c]]), pos + 2
+        if not in_class and c.isdigit():
+            end = pos + 1
+            while end < len(expression) and expression[end].isdigit():
+                end += 1
+            return ('REF', str(int(expression[pos + 1:end]))), end
+        if c.isalnum():
+            raise self.error(expression, pos, f'bad escape \\{c}')
+        return ('LIT', c), pos + 2
+
+    @staticmethod
+    def error(expression, pos, message):
+        return Exception(f'Error in expression {expression} at position {pos}: {message}')
+
+    # emits the AST into a tree, nested items are emitted with an explicit stack of generators rather
+    # than by recursion, so the depth of python's stack does not grow with the expression
+    def build_tree(self, ast):
+        tree = Tree()
+        stack = [self.emit_alternation(tree, ast, -1, -1)]
+        value = None
+        while stack:
+            try:
+                request = stack[-1].send(value)
+            except StopIteration as stop:
+                stack.pop()
+                value = stop.value
+                continue
+            stack.append(request)
+            value = None
+        return tree
+
+    def emit_alternation(self, tree, alt, father_id, brother_id):
+        _, alternatives, weights = alt
+        if len(alternatives) == 1:
+            return (yield self.emit_sequence(tree, alternatives[0], father_id, brother_id))
+
+        # the expression holds a single branch whose alternatives are kept in its info list
+        node_id = tree.add_inner_node(InnerNode('EXPRESSION'), father_id, brother_id)
+        branch = InnerNode('BRANCH', [list(weights)])
+        tree.add_inner_node(branch, node_id, -1)
+        for items in alternatives:
+            alternative_id = yield self.emit_sequence(tree, items, -1, -1)
+            branch.type_specific_info.append(alternative_id)
+        return node_id
+
+    def emit_sequence(self, tree, items, father_id, brother_id):
+        node_id = tree.add_inner_node(InnerNode('EXPRESSION'), father_id, brother_id)
+        father_id, brother_id = node_id, -1
+        for item in items:
+            result = self.emit_item(tree, item, father_id, brother_id)
+            if isinstance(result, GeneratorType):
+                result = yield result
+            father_id, brother_id = -1, result
+        return node_id
+
+    def emit_item(self, tree, item, father_id, brother_id):
+        kind = item[0]
+        if kind == 'LIT' or kind == 'IN' or kind == 'AT':
+            leaf = Leaf(item[1] if kind == 'IN' else (item[1],))
+            node = InnerNode('LITERAL' if kind == 'LIT' else kind)
+            node.leaf_id = tree.add_leaf(leaf)
+            return tree.add_inner_node(node, father_id, brother_id)
+
+        if kind == 'REF':
+            node = InnerNode('GROUPREF', (item[1],))
+            return tree.add_inner_node(node, father_id, brother_id)
+
+        return self.emit_nested(tree, item, father_id, brother_id)
+
+    def emit_nested(self, tree, item, father_id, brother_id):
+        kind = item[0]
+        if kind == 'GROUP':
+            node_id = tree.add_inner_node(InnerNode('GROUP', (item[1],)), father_id, brother_id)
+            tree.group_to_node_id[item[1]] = node_id
+            yield self.emit_alternation(tree, item[2], node_id, -1)
+        elif kind == 'REPEAT':
+            _, min_repeat, max_repeat, weights, child = item
+            node = InnerNode('MAX_REPEAT', (list(weights), min_repeat, max_repeat + 1))
+            node_id = tree.add_inner_node(node, father_id, brother_id)
+            yield self.emit_sequence(tree, [child], node_id, -1)
+        else:
+            node_id = yield self.emit_alternation(tree, item, father_id, brother_id)
+        return node_id
+
+
+# Removes the generation only annotations (alternative weights ~N, with the space before them, and
+# repeat weights <a,b,...>) so that the expression can be matched as a regular expression.
+def strip_annotations(expression):
+    out = []
+    pos = 0
+    n = len(expression)
+    in_class = False
+    after_quantifier = False
+    while pos < n:
+        c = expression[pos]
+        if c == '\\' and pos + 1 < n:
+            out.append(expression[pos:pos + 2])
+            pos += 2
+            after_quantifier = False
+            continue
+        if in_class:
+            in_class = c != ']'
+            out.append(c)
+            pos += 1
+            continue
+        if c == '[':
+            # a ] right after the opening [ or [^ is a literal
+            end = pos + 1
+            if end < n and expression[end] == '^':
+                end += 1
+            if end < n and expression[end] == ']':
+                end += 1
+            out.append(expression[pos:end])
+            pos = end
+            in_class = True
+            after_quantifier = False
+            continue
+        if c == '~' and pos + 1 < n and expression[pos + 1].isdigit():
+            if out and out[-1] == ' ':
+                out.pop()
+            pos += 1
+            while pos < n and expression[pos].isdigit():
+                pos += 1
+            continue
+        if c == '<' and after_quantifier:
+            end = expression.find('>', pos)
+            body = expression[pos + 1:end] if end != -1 else ''
+            if end != -1 and all(x.isdigit() or x == ',' for x in body) and any(x.isdigit() for x in body):
+                pos = end + 1
+                after_quantifier = False
+                continue
+        after_quantifier = c in '*+?}'
+        out.append(c)
+        pos += 1
+    return ''.join(out)
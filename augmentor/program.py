@@ -0,0 +1,499 @@
+from bisect import bisect_right
+
+import numpy as np
+
+# opcodes of the compiled sampling program
+OP_EXPRESSION = 0
+OP_LEAF = 1
+OP_GROUP = 2
+OP_GROUPREF = 3
+OP_MAX_REPEAT = 4
+OP_BRANCH = 5
+
+OPCODE_NAMES = ['EXPRESSION', 'LEAF', 'GROUP', 'GROUPREF', 'MAX_REPEAT', 'BRANCH']
+
+
+class Program:
+    # A Tree flattened into struct-of-arrays form. Node i is described by opcode[i], child[i],
+    # brother[i] and arg[i]; arg is a leaf index for LEAF, a group slot for GROUP/GROUPREF and a
+    # choice table index for BRANCH/MAX_REPEAT. Choice table t spans table_value/table_cum in
+    # [table_start[t], table_start[t + 1]), table_value holding child ids (BRANCH) or repeat
+    # counts (MAX_REPEAT) and table_cum the cumulative drawing weights.
+
+    def __init__(self, opcode, child, brother, arg, leaves, table_start, table_value, table_cum, n_groups):
+        self.opcode = opcode
+        self.child = child
+        self.brother = brother
+        self.arg = arg
+        self.leaves = leaves
+        self.table_start = table_start
+        self.table_value = table_value
+        self.table_cum = table_cum
+        self.n_groups = n_groups
+        self._lists = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_lists'] = None
+        return state
+
+    @classmethod
+    def from_tree(cls, tree):
+        n = len(tree.inner_nodes)
+        opcode = np.zeros(n, dtype=np.int8)
+        child = np.full(n, -1, dtype=np.int32)
+        brother = np.full(n, -1, dtype=np.int32)
+        arg = np.full(n, -1, dtype=np.int32)
+
+        group_slots = {}
+        for group_id in tree.group_to_node_id.keys():
+            group_slots[group_id] = len(group_slots)
+
+        table_start = [0]
+        table_value = []
+        table_cum = []
+
+        def add_table(values, weights):
+            if len(values) != len(weights):
+                raise Exception(f'Weights {weights} do not match options {values}')
+            cum = np.cumsum(np.array(weights, dtype=np.int64))
+            if len(cum) == 0 or cum[-1] <= 0:
+                raise Exception(f'Invalid weights {weights}')
+            table_value.extend(values)
+            table_cum.extend(cum.tolist())
+            table_start.append(len(table_value))
+            return len(table_start) - 2
+
+        for i, node in enumerate(tree.inner_nodes):
+            child[i] = node.child_id
+            brother[i] = node.brother_id
+            if node.leaf_id != -1:
+                opcode[i] = OP_LEAF
+                arg[i] = node.leaf_id
+            elif node.type_str == 'GROUP':
+                opcode[i] = OP_GROUP
+                arg[i] = group_slots[node.type_specific_info[0]]
+            elif node.type_str == 'GROUPREF':
+                opcode[i] = OP_GROUPREF
+                arg[i] = group_slots[node.type_specific_info[0]]
+            elif node.type_str == 'MAX_REPEAT':
+                min_repeat, max_repeat = node.type_specific_info[1], node.type_specific_info[2]
+                weights = node.type_specific_info[0]
+                if len(weights) == 0:
+                    weights = [1] * (max_repeat - min_repeat)
+                opcode[i] = OP_MAX_REPEAT
+                arg[i] = add_table(list(range(min_repeat, max_repeat)), weights)
+            elif node.type_str == 'BRANCH':
+                alternatives = node.type_specific_info[1:]
+                weights = node.type_specific_info[0]
+                if len(alternatives) == 1:
+                    weights = [1]
+                opcode[i] = OP_BRANCH
+                arg[i] = add_table(alternatives, weights)
+            elif node.type_str == 'EXPRESSION':
+                opcode[i] = OP_EXPRESSION
+            else:
+                raise Exception(f'Wrong type {i}')
+
+        leaves = []
+        for leaf in tree.leaves:
+            if leaf.num_options() == 0:
+                raise Exception(f'Invalid leaf {len(leaves)}')
+            leaves.append(leaf.options)
+
+        return cls(opcode, child, brother, arg, leaves,
+                   np.array(table_start, dtype=np.int32),
+                   np.array(table_value, dtype=np.int32),
+                   np.array(table_cum, dtype=np.int64),
+                   len(group_slots))
+
+    def num_nodes(self):
+        return len(self.opcode)
+
+    def as_lists(self):
+        # plain python mirrors of the arrays, indexing numpy scalars one at a time is slow
+        if self._lists is None:
+            starts = self.table_start.tolist()
+            values = self.table_value.tolist()
+            cums = self.table_cum.tolist()
+            tables = [(values[starts[t]:starts[t + 1]], cums[starts[t]:starts[t + 1]])
+                      for t in range(len(starts) - 1)]
+            self._lists = (self.opcode.tolist(), self.child.tolist(), self.brother.tolist(), self.arg.tolist(),
+                           tables)
+        return self._lists
+
+    def sample(self, do_print=False, rng=None, cover=None):
+        # iterative traversal with an explicit stack, a negative entry ~i closes the group of node i.
+        # a Coverage as cover steers the decisions to uncovered options, see covering_choice
+        if self.num_nodes() == 0:
+            return []
+        if rng is None:
+            rng = np.random.default_rng()
+        opcode, child, brother, arg, tables = self.as_lists()
+        leaves = self.leaves
+        groups = [None] * self.n_groups
+        group_start = [0] * self.n_groups
+        out = []
+        stack = [0]
+        while stack:
+            node_id = stack.pop()
+            if node_id < 0:
+                slot = arg[~node_id]
+                groups[slot] = ''.join(out[group_start[slot]:])
+                continue
+
+            op = opcode[node_id]
+            if do_print:
+                print('@@@node: ', node_id, ' son:', child[node_id], ' brother: ', brother[node_id], ' ',
+                      OPCODE_NAMES[op])
+            if brother[node_id] != -1:
+                stack.append(brother[node_id])
+
+            if op == OP_LEAF:
+                options = leaves[arg[node_id]]
+                if len(options) == 1:
+                    out.append(options[0])
+                else:
+                    out.append(options[rng.integers(0, len(options))])
+            elif op == OP_EXPRESSION:
+                if child[node_id] != -1:
+                    stack.append(child[node_id])
+            elif op == OP_GROUP:
+                group_start[arg[node_id]] = len(out)
+                stack.append(~node_id)
+                stack.append(child[node_id])
+            elif op == OP_GROUPREF:
+                value = groups[arg[node_id]]
+                if value is None:
+                    raise Exception(f'Group reference {node_id} to a group that was not traversed')
+                out.append(value)
+            else:
+                values, cum = tables[arg[node_id]]
+                if cover is not None:
+                    picked = values[self.covering_choice(node_id, cover, rng)]
+                elif len(values) == 1:
+                    picked = values[0]
+                else:
+                    picked = values[bisect_right(cum, rng.integers(0, cum[-1]))]
+                if op == OP_BRANCH:
+                    stack.append(picked)
+                else:
+                    stack.extend([child[node_id]] * picked)
+        return out
+
+    def sample_batch(self, n, rng=None):
+        # draws n samples at once, every decision point draws the choices of all the samples
+        # that reach it with one numpy call and the samples are split by the drawn choice
+        if rng is None:
+            rng = np.random.default_rng()
+        if n <= 0:
+            return []
+        if self.num_nodes() == 0:
+            return [''] * n
+        opcode, child, brother, arg, _ = self.as_lists()
+        leaves = self.leaves
+        groups = [None] * self.n_groups
+        group_start = [None] * self.n_groups
+        outs = [[] for _ in range(n)]
+        stack = [(0, np.arange(n))]
+        while stack:
+            node_id, active = stack.pop()
+            active_lst = active.tolist()
+            if node_id < 0:
+                slot = arg[~node_id]
+                starts = group_start[slot]
+                values = groups[slot]
+                for i in active_lst:
+                    values[i] = ''.join(outs[i][starts[i]:])
+                continue
+
+            op = opcode[node_id]
+            if brother[node_id] != -1:
+                stack.append((brother[node_id], active))
+
+            if op == OP_LEAF:
+                options = leaves[arg[node_id]]
+                if len(options) == 1:
+                    x = options[0]
+                    for i in active_lst:
+                        outs[i].append(x)
+                else:
+                    picked = rng.integers(0, len(options), size=len(active_lst)).tolist()
+                    for i, k in zip(active_lst, picked):
+                        outs[i].append(options[k])
+            elif op == OP_EXPRESSION:
+                if child[node_id] != -1:
+                    stack.append((child[node_id], active))
+            elif op == OP_GROUP:
+                slot = arg[node_id]
+                if groups[slot] is None:
+                    groups[slot] = [None] * n
+                    group_start[slot] = [0] * n
+                starts = group_start[slot]
+                for i in active_lst:
+                    starts[i] = len(outs[i])
+                stack.append((~node_id, active))
+                stack.append((child[node_id], active))
+            elif op == OP_GROUPREF:
+                values = groups[arg[node_id]]
+                for i in active_lst:
+                    if values is None or values[i] is None:
+                        raise Exception(f'Group reference {node_id} to a group that was not traversed')
+                    outs[i].append(values[i])
+            else:
+                start, end = self.table_start[arg[node_id]], self.table_start[arg[node_id] + 1]
+                values = self.table_value[start:end]
+                cum = self.table_cum[start:end]
+                if len(values) == 1:
+                    picked = np.full(len(active), values[0])
+                else:
+                    picked = values[np.searchsorted(cum, rng.integers(0, cum[-1], size=len(active)), side='right')]
+                if op == OP_BRANCH:
+                    for alternative in np.unique(picked)[::-1]:
+                        stack.append((int(alternative), active[picked == alternative]))
+                else:
+                    for k in range(int(picked.max()) - 1, -1, -1):
+                        repeating = active[picked > k]
+                        stack.append((child[node_id], repeating))
+        return [''.join(out) for out in outs]
+
+    # Coverage targets are the options of the decision nodes, every BRANCH alternative and every
+    # MAX_REPEAT count, identified by their position in table_value. Options with zero weight are never
+    # drawn and are not targets, nor is anything only they lead to.
+    def coverage(self):
+        return Coverage(self)
+
+    # The option drawn at a decision node in a covering traversal: the one that covers the most targets,
+    # its own when it is uncovered plus the uncovered targets under it (for a repeat count, at most one
+    # per repetition). Ties are drawn by weight, and so is every option once nothing is left to cover.
+    # The drawn option is covered.
+    def covering_choice(self, node_id, coverage, rng):
+        opcode, child, _, arg, tables = self.as_lists()
+        op = opcode[node_id]
+        values, cum = tables[arg[node_id]]
+        start = int(self.table_start[arg[node_id]])
+        covered, uncovered = coverage.covered, coverage.uncovered
+        scores = []
+        for k in range(len(values)):
+            weight = cum[k] - (cum[k - 1] if k > 0 else 0)
+            if weight == 0:
+                scores.append(-1)
+                continue
+            score = int(start + k not in covered)
+            if op == OP_BRANCH:
+                score += uncovered[values[k]]
+            elif values[k] > 0:
+                score += min(values[k], uncovered[child[node_id]])
+            scores.append(score)
+
+        best = max(scores)
+        if best <= 0:
+            k = 0 if len(values) == 1 else bisect_right(cum, rng.integers(0, cum[-1]))
+        else:
+            candidates = [k for k in range(len(values)) if scores[k] == best]
+            weights = [cum[k] - (cum[k - 1] if k > 0 else 0) for k in candidates]
+            k = candidates[bisect_right(np.cumsum(weights).tolist(), rng.integers(0, sum(weights)))]
+        coverage.cover(start + k)
+        return k
+
+    # Covering traversals, each one steered to at least one uncovered target, until every target is
+    # covered or `limit` distinct samples were drawn. Returns the samples and the Coverage of the targets.
+    def covering_samples(self, rng=None, limit=None):
+        coverage = self.coverage()
+        if self.num_nodes() == 0:
+            return [''], coverage
+        if rng is None:
+            rng = np.random.default_rng()
+        samples = []
+        distinct = set()
+        while len(coverage.covered) < coverage.num_targets and (limit is None or len(distinct) < limit):
+            sample = ''.join(self.sample(False, rng, coverage))
+            samples.append(sample)
+            distinct.add(sample)
+        return samples, coverage
+
+    def language_size(self):
+        # number of distinct derivations of the program, an exact count of the outputs for
+        # unambiguous patterns and an upper bound otherwise. Children and brothers are always
+        # created after their node, so one pass over the ids in reverse order is enough.
+        n = self.num_nodes()
+        if n == 0:
+            return 1
+        opcode, child, brother, arg, tables = self.as_lists()
+        seq_count = [1] * n
+        for node_id in range(n - 1, -1, -1):
+            op = opcode[node_id]
+            if op == OP_LEAF:
+                count = len(self.leaves[arg[node_id]])
+            elif op == OP_GROUPREF:
+                count = 1
+            elif op == OP_EXPRESSION or op == OP_GROUP:
+                count = 1 if child[node_id] == -1 else seq_count[child[node_id]]
+            else:
+                count = 0
+                values, cum = tables[arg[node_id]]
+                for k in range(len(values)):
+                    if cum[k] == (cum[k - 1] if k > 0 else 0):
+                        continue  # a zero weight option is never drawn
+                    if op == OP_BRANCH:
+                        count += seq_count[values[k]]
+                    else:
+                        count += seq_count[child[node_id]] ** values[k]
+            if brother[node_id] != -1:
+                count *= seq_count[brother[node_id]]
+            seq_count[node_id] = count
+        return seq_count[0]
+
+    def enumerate(self):
+        # all the outputs of the program with their exact probabilities
+        if self.num_nodes() == 0:
+            return {'': 1.0}
+        states = self._expand([('', (None,) * self.n_groups, 1.0)])
+        probabilities = {}
+        for text, _, p in states:
+            probabilities[text] = probabilities.get(text, 0.0) + p
+        return probabilities
+
+    def _expand(self, states):
+        # Expands the states over the whole program with an explicit stack of operations, so deep nesting
+        # does not recurse. A state is (text so far, values of the groups, probability of the derivation).
+        # The operations work on a stack of state lists:
+        #   ('seq', i)            expand node i and then its brothers
+        #   ('node', i)           expand node i
+        #   ('load', states)      push states
+        #   ('close', slot, at)   set the group slot of the states to their text from position at
+        #   ('collect', m)        join the top m state lists into one
+        #   ('merge',)            merge the equal states of the top list
+        # Every node ends with a merge of its states, as a recursive expansion would do.
+        opcode, child, brother, arg, tables = self.as_lists()
+        data = [states]
+        ops = [('seq', 0)]
+        while ops:
+            op = ops.pop()
+            kind = op[0]
+            if kind == 'seq':
+                node_id = op[1]
+                if brother[node_id] != -1:
+                    ops.append(('seq', brother[node_id]))
+                ops.append(('node', node_id))
+            elif kind == 'node':
+                self._expand_node(op[1], data, ops, opcode, child, arg, tables)
+            elif kind == 'load':
+                data.append(op[1])
+            elif kind == 'close':
+                _, slot, at = op
+                data.append([(text, groups[:slot] + (text[at:],) + groups[slot + 1:], p)
+                             for text, groups, p in data.pop()])
+            elif kind == 'collect':
+                lists = data[len(data) - op[1]:]
+                del data[len(data) - op[1]:]
+                data.append(self._merge_states([state for states in lists for state in states]))
+            else:
+                data.append(self._merge_states(data.pop()))
+        return data.pop()
+
+    def _expand_node(self, node_id, data, ops, opcode, child, arg, tables):
+        op = opcode[node_id]
+        if op == OP_LEAF:
+            options = self.leaves[arg[node_id]]
+            data.append(self._merge_states([(text + option, groups, p / len(options))
+                                            for text, groups, p in data.pop() for option in options]))
+        elif op == OP_EXPRESSION:
+            if child[node_id] != -1:
+                ops.append(('merge',))
+                ops.append(('seq', child[node_id]))
+        elif op == OP_GROUP:
+            # every state is expanded on its own, its group starts at the end of its text
+            states = data.pop()
+            ops.append(('collect', len(states)))
+            for state in reversed(states):
+                ops.append(('close', arg[node_id], len(state[0])))
+                ops.append(('seq', child[node_id]))
+                ops.append(('load', [state]))
+        elif op == OP_GROUPREF:
+            slot = arg[node_id]
+            new_states = []
+            for text, groups, p in data.pop():
+                if groups[slot] is None:
+                    raise Exception(f'Group reference {node_id} to a group that was not traversed')
+                new_states.append((text + groups[slot], groups, p))
+            data.append(self._merge_states(new_states))
+        else:
+            states = data.pop()
+            values, cum = tables[arg[node_id]]
+            options = [k for k in range(len(values)) if cum[k] != (cum[k - 1] if k > 0 else 0)]
+            ops.append(('collect', len(options)))
+            for k in reversed(options):
+                weight = cum[k] - (cum[k - 1] if k > 0 else 0)
+                if op == OP_BRANCH:
+                    ops.append(('seq', values[k]))
+                else:
+                    ops.extend([('seq', child[node_id])] * values[k])
+                ops.append(('load', [(text, groups, p * weight / cum[-1]) for text, groups, p in states]))
+
+    @staticmethod
+    def _merge_states(states):
+        merged = {}
+        for text, groups, p in states:
+            key = (text, groups)
+            merged[key] = merged.get(key, 0.0) + p
+        return [(text, groups, p) for (text, groups), p in merged.items()]
+
+    def probability_table(self):
+        # compact (variants, probabilities) table of the whole language
+        probabilities = self.enumerate()
+        variants = list(probabilities.keys())
+        return variants, np.array([probabilities[v] for v in variants], dtype=np.float64)
+
+
+class Coverage:
+    # The coverage targets of a program (see Program.coverage) and the ones covered so far. A sequence
+    # head is the first node of a sequence: the root, the child of an EXPRESSION, GROUP or MAX_REPEAT
+    # node and every BRANCH alternative. uncovered[head] counts the uncovered targets of the sequence
+    # and of everything nested in it, and heads[target] lists the sequence heads that hold the target,
+    # so covering a target costs one update per enclosing sequence and a decision reads one count per
+    # option.
+
+    def __init__(self, program):
+        n = program.num_nodes()
+        opcode, child, brother, arg, tables = program.as_lists()
+        starts = program.table_start.tolist()
+        self.uncovered = [0] * n
+        self.heads = {}
+        self.covered = set()
+        # (head, the heads that enclose it) of every reachable sequence
+        stack = [(0, ())] if n else []
+        while stack:
+            head, enclosing = stack.pop()
+            enclosing = enclosing + (head,)
+            node_id = head
+            while node_id != -1:
+                op = opcode[node_id]
+                if op == OP_EXPRESSION or op == OP_GROUP:
+                    if child[node_id] != -1:
+                        stack.append((child[node_id], enclosing))
+                elif op == OP_BRANCH or op == OP_MAX_REPEAT:
+                    values, cum = tables[arg[node_id]]
+                    repeated = False
+                    for k in range(len(values)):
+                        if cum[k] == (cum[k - 1] if k > 0 else 0):
+                            continue
+                        self.heads[starts[arg[node_id]] + k] = enclosing
+                        if op == OP_BRANCH:
+                            stack.append((values[k], enclosing))
+                        elif values[k] > 0:
+                            repeated = True
+                    if repeated:
+                        stack.append((child[node_id], enclosing))
+                node_id = brother[node_id]
+        for enclosing in self.heads.values():
+            for head in enclosing:
+                self.uncovered[head] += 1
+        self.num_targets = len(self.heads)
+
+    def cover(self, target):
+        if target in self.covered:
+            return
+        self.covered.add(target)
+        for head in self.heads[target]:
+            self.uncovered[head] -= 1
@@ -1,10 +1,16 @@
 import re
+from collections import deque
+
 import pandas as pd
 
+from augmentor.stats import timed
+
 
 class ExpressionsReader:
-    def __init__(self):  # type: ignore
-        return
+    ref_regex = "(<<[A-Za-z0-9_]+>>)"
+
+    def __init__(self, stats=None):  # type: ignore
+        self.stats = stats
 
     # Normalizing regex
     def normalize_expr(self, exp):
@@ -65,32 +71,18 @@ class ExpressionsReader:
 
         return locs
 
-    def replace_output_only(self, df):
+    # replaces the output only alternatives by QQQnQQQ placeholders, numbered from first_dummy, and adds
+    # the placeholders as output only rules
+    def replace_output_only(self, df, first_dummy=0):
         exprs = df.expression.values
-        dummy_name = 'QQQ'
-        dummy_name_counter = 0
+        dummy_name_counter = first_dummy
         new_expr_dict = {"expression": [], "logical_rule_name": []}
         for i in range(len(df)):
-            expr = '(' + exprs[i] + ')'
-
-            perc_locations_list = self.percents_locations(expr)
-            fr = 0
-            out_i = []
-            for loc in perc_locations_list:
-                to = loc[0]
-                out_i.extend(expr[fr:to])
-                dummy_expr = 'QQQ' + str(dummy_name_counter) + 'QQQ'
-                dummy_name_counter += 1
-                combined_expr = expr[loc[0]:(loc[1] - 1)]  # to-1 so as to remove the %
+            exprs[i], placeholders = self.rewrite_output_only(exprs[i], dummy_name_counter)
+            dummy_name_counter += len(placeholders)
+            for combined_expr, dummy_expr in placeholders:
                 new_expr_dict["expression"].append(combined_expr)
                 new_expr_dict["logical_rule_name"].append(dummy_expr)
-                out_i.extend(dummy_expr)
-                fr = loc[1]
-            to = len(expr)
-            if to > fr:
-                out_i.extend(expr[fr:to])
-            out_i = "".join(out_i)
-            exprs[i] = out_i
 
         df["output_only"] = 0
         if len(new_expr_dict) > 0:
@@ -99,76 +91,119 @@ class ExpressionsReader:
             df = pd.concat([df, df_new]).copy()
         return df
 
+    # the expression with its output only alternatives replaced by placeholders numbered from
+    # first_dummy, and the (alternative, placeholder) pairs
+    def rewrite_output_only(self, expr, first_dummy=0):
+        expr = '(' + expr + ')'
+        dummy_name_counter = first_dummy
+        placeholders = []
+        fr = 0
+        out_i = []
+        for loc in self.percents_locations(expr):
+            to = loc[0]
+            out_i.extend(expr[fr:to])
+            dummy_expr = 'QQQ' + str(dummy_name_counter) + 'QQQ'
+            dummy_name_counter += 1
+            combined_expr = expr[loc[0]:(loc[1] - 1)]  # to-1 so as to remove the %
+            placeholders.append((combined_expr, dummy_expr))
+            out_i.extend(dummy_expr)
+            fr = loc[1]
+        to = len(expr)
+        if to > fr:
+            out_i.extend(expr[fr:to])
+        return "".join(out_i), placeholders
+
     # reads the expressions and remove back references in expressions
     def read_expressions(self, expressions_fname):
+        return self.prepare_expressions(self.read_rules(expressions_fname))[0]
 
+    # the rules as written in the files, trimmed
+    def read_rules(self, expressions_fname):
         cols = ["expression", "logical_rule_name"]
         converters = {'expression': self.normalize_expr, 'logical_rule_name': self.normalize_expr}  # Trimming
-        if type(expressions_fname) == list:
-            dfs = []
-            for fn in expressions_fname:
-                dfs.append(pd.read_csv(fn, comment="#", header=None, names=cols, converters=converters))
-            df = pd.concat(dfs, axis=0, ignore_index=True)
-        else:
-            df = pd.read_csv(expressions_fname, comment="#", header=None, names=cols, converters=converters,
-                             delimiter=';')
-        df = self.replace_output_only(df)
-
-        df["seen"] = 0
+        with timed(self.stats, 'read_csv'):
+            if type(expressions_fname) == list:
+                dfs = []
+                for fn in expressions_fname:
+                    dfs.append(pd.read_csv(fn, comment="#", header=None, names=cols, converters=converters,
+                                           delimiter=';'))
+                df = pd.concat(dfs, axis=0, ignore_index=True)
+            else:
+                df = pd.read_csv(expressions_fname, comment="#", header=None, names=cols, converters=converters,
+                                 delimiter=';')
+        return df
+
+    # Rewrites the output only alternatives of the rules read by read_rules and resolves their references.
+    # Returns the resolved table (the rules in reversed topological order and then the output only rules)
+    # and the rules in their input order as (expression, rewritten expression, name, resolved expression).
+    def prepare_expressions(self, df):
+        originals = df.expression.tolist()
+        with timed(self.stats, 'output_only_rewrite'):
+            df = self.replace_output_only(df.copy())
 
         df_output_only = df[df.output_only == True].copy()
         df = df[df.output_only == False].copy()
 
-        # Since regular expressions may contain references to other expressions,
-        # we do a topological sort of the expressions. In case there are cyclic
-        # references you end up with an empty queue and raise an assert.
+        # Since regular expressions may contain references to other expressions, we
+        # substitute them in a topological order of the references graph.
         # Note: we don't want to claculate these references on the output only rules.
-        queue_ = []
-        ref_regex = "(<<[A-Za-z0-9_]+>>)"
-        for index, row_ in df.iterrows():
-            has_subexpressions = False
-            # sorry, the _ is linter's request
-            for _ in re.finditer(ref_regex, row_.expression):
-                has_subexpressions = True
-            if not has_subexpressions:
-                queue_.append(index)
-                df.at[index, 'seen'] = 1
-        head_of_q = 0
-        while len(queue_) > head_of_q:
-            curr = df.iloc[queue_[head_of_q]].logical_rule_name
-            curr_exp = df.iloc[queue_[head_of_q]].expression
-            for index, row_ in df.iterrows():
-                # prevents infinite loop
-                if df.iloc[index]['seen'] > 0:
-                    continue
-                str_parts = []
-                from_pos = 0
-                changed = False
-                expr = row_.expression
-                for match in re.finditer(curr, expr):
-                    changed = True
-                    start_pos = match.start()
-                    end_pos = match.end()
-                    str_parts.extend(expr[from_pos:start_pos])
-                    str_parts.extend(self.bound_with_parentheses(curr_exp))
-                    from_pos = end_pos
-                str_parts.extend(expr[from_pos: len(expr)])
-                if changed:
-                    str_parts = self.clean_redundant_parentheses("".join(str_parts))
-                    df.expression.values[index] = str_parts
-                    # this is after the update
-                    if len(re.findall(ref_regex, str_parts)) == 0:
-                        queue_.append(index)
-                        df.at[index, 'seen'] = 1
-            head_of_q = head_of_q + 1
-
-        # Fixing order of df according to queue_
-        queue_.reverse()
-        df = df.reindex(queue_).reset_index(drop=True)
-        if min(df.seen.values) == 0:
-            assert "Error "  # there is a cyclic reference so not everything is covered
-
-        df = pd.concat([df, df_output_only]).copy()
+        names = df.logical_rule_name.tolist()
+        exprs = df.expression.tolist()
+        with timed(self.stats, 'resolve_references'):
+            order, resolved = self.resolve_rules(names, exprs)
+        rules = list(zip(originals, exprs, names, resolved))
+
+        df = pd.concat([self.resolved_table(order, resolved, names), df_output_only]).copy()
         df.reset_index(drop=True, inplace=True)
-        df.drop(columns="seen", inplace=True)
-        return df
+        return df, rules
+
+    # the resolved rules in reversed topological order (rules that use others first)
+    def resolved_table(self, order, resolved, names):
+        order = order[::-1]
+        return pd.DataFrame({"expression": [resolved[i] for i in order],
+                             "logical_rule_name": [names[i] for i in order],
+                             "output_only": 0})
+
+    # Resolves the <<ref>> references of every rule, each rule is substituted once after all the rules it
+    # references. Rules whose (name, expression) is in keep are already resolved to keep[(name, expression)]
+    # and are not substituted again. Returns the topological order of the rules and their resolved expressions.
+    def resolve_rules(self, names, exprs, keep=None):
+        exprs = list(exprs)
+        row_of_name = {}
+        for i, name in enumerate(names):
+            row_of_name.setdefault(name, i)
+
+        dependents = [[] for _ in names]
+        n_dependencies = [0] * len(names)
+        missing = []
+        for i, expr in enumerate(exprs):
+            for ref in set(re.findall(self.ref_regex, expr)):
+                if ref not in row_of_name:
+                    missing.append(f'{names[i]} -> {ref}')
+                    continue
+                dependents[row_of_name[ref]].append(i)
+                n_dependencies[i] += 1
+        if missing:
+            raise Exception(f'Error unresolved references: {", ".join(missing)}')
+
+        queue_ = deque(i for i in range(len(names)) if n_dependencies[i] == 0)
+        order = []
+        resolved = {}
+        while queue_:
+            i = queue_.popleft()
+            order.append(i)
+            if keep is not None and (names[i], exprs[i]) in keep:
+                exprs[i] = keep[(names[i], exprs[i])]
+            else:
+                expr = re.sub(self.ref_regex, lambda m: self.bound_with_parentheses(resolved[m.group(0)]), exprs[i])
+                exprs[i] = self.clean_redundant_parentheses(expr) if expr != exprs[i] else expr
+            resolved.setdefault(names[i], exprs[i])
+            for d in dependents[i]:
+                n_dependencies[d] -= 1
+                if n_dependencies[d] == 0:
+                    queue_.append(d)
+
+        if len(order) < len(names):
+            cyclic = [names[i] for i in range(len(names)) if n_dependencies[i] > 0]
+            raise Exception(f'Error cyclic references between rules: {", ".join(cyclic)}')
+        return order, exprs
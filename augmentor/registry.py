@@ -0,0 +1,43 @@
+import pandas as pd
+
+
+class RuleRegistry:
+    # The resolved rules in priority order, with dict indexes from a name to its expression and from an
+    # expression to its name. As with the rules table, the first rule of a name (or of an expression) is
+    # the one that is looked up.
+
+    def __init__(self, rules=()):
+        self.names = []
+        self.expressions = []
+        self.expression_of_name = {}
+        self.name_of_expression = {}
+        for name, expression in rules:
+            self.add(name, expression)
+
+    @classmethod
+    def from_dataframe(cls, df):
+        return cls(zip(df.logical_rule_name.tolist(), df.expression.tolist()))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.expression_of_name
+
+    def __iter__(self):
+        return zip(self.names, self.expressions)
+
+    def add(self, name, expression):
+        self.names.append(name)
+        self.expressions.append(expression)
+        self.expression_of_name.setdefault(name, expression)
+        self.name_of_expression.setdefault(expression, name)
+
+    def expression_of(self, name):
+        return self.expression_of_name.get(name)
+
+    def name_of(self, expression):
+        return self.name_of_expression.get(expression)
+
+    def to_dataframe(self):
+        return pd.DataFrame({"expression": self.expressions, "logical_rule_name": self.names, "output_only": 0})
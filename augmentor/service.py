@@ -0,0 +1,192 @@
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from augmentor.generator import Augmentor
+from augmentor.stats import StatsCollector
+
+
+class AugmentationService:
+    # Answers variant requests from one warm Augmentor: the rules are read and resolved once and the
+    # compiled rules and their sample pools stay in its cache between requests. A request is a dict
+    #   {"utterance": ..., "n": 10, "unique": false}         n variants of the utterance
+    #   {"op": "page", "utterance": ..., "start": 0, "stop": 10, "n": 100}
+    #                                                        variants start..stop of the ordered product
+    #   {"op": "count", "utterance": ..., "n": 100}          size of the ordered product
+    #   {"op": "stats"}                                      cache and timing counters
+    # and an optional "id" is sent back with the response. The same request always gets the same
+    # variants, they are derived from the seed of the augmentor.
+
+    def __init__(self, augmentor, max_n=10000):
+        self.augmentor = augmentor
+        self.max_n = max_n
+        self.started = time.time()
+
+    def handle(self, request):
+        try:
+            response = self.dispatch(request)
+        except Exception as e:
+            response = {'error': str(e)}
+        if isinstance(request, dict) and 'id' in request:
+            response['id'] = request['id']
+        return response
+
+    def dispatch(self, request):
+        if not isinstance(request, dict):
+            raise Exception('Error a request must be a json object')
+        op = request.get('op', 'variants')
+        if op == 'stats':
+            return self.stats()
+
+        utterance = request.get('utterance')
+        if not isinstance(utterance, str):
+            raise Exception('Error missing utterance')
+        n = request.get('n', 10)
+        if not isinstance(n, int) or n <= 0 or n > self.max_n:
+            raise Exception(f'Error n must be an integer between 1 and {self.max_n}')
+
+        if op == 'variants':
+            variants = self.augmentor.get_variations_list(utterance, n, unique=bool(request.get('unique', False)),
+                                                          normalized=True)
+            return {'variants': variants}
+        if op == 'page':
+            start, stop = request.get('start', 0), request.get('stop', n)
+            if not isinstance(start, int) or not isinstance(stop, int) or stop - start > self.max_n:
+                raise Exception(f'Error start and stop must be integers at most {self.max_n} apart')
+            return {'variants': self.augmentor.page(utterance, start, stop, n)}
+        if op == 'count':
+            return {'count': self.augmentor.variant_count(utterance, n)}
+        raise Exception(f'Error unknown op {op}')
+
+    def stats(self):
+        out = {'uptime': time.time() - self.started, 'cache': self.augmentor.sample_cache.info()}
+        if self.augmentor.stats is not None:
+            out['stats'] = self.augmentor.stats.to_dict()
+        return out
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    # POST / with a json request, GET /stats and GET /health
+    service = None
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.reply(200, {'status': 'ok'})
+        elif self.path == '/stats':
+            self.reply(200, self.service.stats())
+        else:
+            self.reply(404, {'error': f'Error unknown path {self.path}'})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length))
+        except ValueError as e:
+            self.reply(400, {'error': f'Error invalid json: {e}'})
+            return
+        response = self.service.handle(request)
+        self.reply(400 if 'error' in response else 200, response)
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        return  # no line on stderr per request
+
+
+def make_server(service, host='127.0.0.1', port=8080):
+    handler = type('BoundServiceRequestHandler', (ServiceRequestHandler,), {'service': service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+# Reads one json request per line and writes one json response per line, in the input order. Up to
+# `threads` requests are handled at a time. A response is written as soon as it and the ones before it
+# are done, also while the next line is still awaited, so an interactive client gets its answers
+# without closing the input. At most `window` requests are in flight, reading waits for the oldest.
+def serve_jsonl(service, lines, out, threads=4, window=None):
+    if window is None:
+        window = 4 * threads
+
+    def handle_line(line):
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return {'error': f'Error invalid json: {e}'}
+        return service.handle(request)
+
+    def write_responses():
+        while True:
+            future = pending.get()
+            if future is None:
+                return
+            out.write(json.dumps(future.result()) + '\n')
+            out.flush()
+
+    pending = queue.Queue(maxsize=window)
+    writer = threading.Thread(target=write_responses, daemon=True)
+    writer.start()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        try:
+            for line in lines:
+                if line.strip():
+                    pending.put(executor.submit(handle_line, line))
+        finally:
+            pending.put(None)
+            writer.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve utterance variants from warm compiled rules')
+    parser.add_argument('expressions', nargs='+', help='rule table files')
+    parser.add_argument('--bundle', help='compiled rules bundle, rebuilt when the rule files change')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--cache-entries', type=int, default=4096)
+    parser.add_argument('--cache-bytes', type=int)
+    parser.add_argument('--stats', action='store_true', help='collect timing statistics, see the stats op')
+    parser.add_argument('--coverage', action='store_true',
+                        help='sample pools that hit every alternative and repeat count of the rules')
+    parser.add_argument('--max-n', type=int, default=10000, help='the most variants of a single request')
+    parser.add_argument('--watch', type=float, metavar='SECONDS',
+                        help='reload the changed rules when the rule files change, checked every SECONDS')
+    parser.add_argument('--stdin', action='store_true', help='serve json lines on stdin instead of http')
+    parser.add_argument('--threads', type=int, default=4, help='requests handled at a time with --stdin')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args(argv)
+
+    expressions = args.expressions if len(args.expressions) > 1 else args.expressions[0]
+    kwargs = {'cache_entries': args.cache_entries, 'cache_bytes': args.cache_bytes, 'seed': args.seed,
+              'stats': StatsCollector() if args.stats else None, 'coverage': args.coverage}
+    if args.bundle:
+        augmentor = Augmentor.from_bundle(args.bundle, expressions, [], **kwargs)
+    else:
+        augmentor = Augmentor(expressions, [], **kwargs)
+    service = AugmentationService(augmentor, args.max_n)
+    if args.watch:
+        augmentor.watch_rules(args.watch, on_error=lambda e: print(f'Reload failed: {e}', file=sys.stderr))
+
+    if args.stdin:
+        serve_jsonl(service, sys.stdin, sys.stdout, args.threads)
+        return
+    server = make_server(service, args.host, args.port)
+    print(f'Serving on http://{args.host}:{server.server_address[1]}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+
+class RuleStats:
+    def __init__(self, name, expression):
+        self.name = name
+        self.expression = expression
+        self.uses = 0
+        self.builds = 0
+        self.compile_time = 0.0
+        self.sample_time = 0.0
+        self.traversals = 0
+        self.distinct = 0
+        self.enumerated = 0
+        self.exhausted = 0
+        # decision options of the rule and how many of them its sample pools hit, in coverage mode
+        self.targets = 0
+        self.covered = 0
+
+    def total_time(self):
+        return self.compile_time + self.sample_time
+
+    # distinct variants found per traversal, low values mean most of the traversals were wasted on repeats
+    def efficiency(self):
+        return self.distinct / self.traversals if self.traversals else None
+
+    def coverage(self):
+        return self.covered / self.targets if self.targets else None
+
+    def to_dict(self):
+        return {'name': self.name, 'expression': self.expression, 'uses': self.uses, 'builds': self.builds,
+                'compile_time': self.compile_time, 'sample_time': self.sample_time, 'total_time': self.total_time(),
+                'traversals': self.traversals, 'distinct': self.distinct, 'efficiency': self.efficiency(),
+                'enumerated': self.enumerated, 'exhausted': self.exhausted, 'targets': self.targets,
+                'covered': self.covered, 'coverage': self.coverage()}
+
+    def merge(self, other):
+        for field in ('uses', 'builds', 'compile_time', 'sample_time', 'traversals', 'distinct', 'enumerated',
+                      'exhausted', 'targets', 'covered'):
+            setattr(self, field, getattr(self, field) + other[field])
+
+
+class StatsCollector:
+    # Collects the wall time and number of calls of every phase of a run and the sampling cost of
+    # every rule. Phases are not nested, so their times add up to the instrumented part of the run.
+    # It may be shared by threads, the counters are updated under a lock.
+
+    def __init__(self):
+        self.phases = {}
+        self.rules = {}
+        self.lock = threading.RLock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+
+    def add_phase(self, name, seconds, calls=1):
+        with self.lock:
+            phase = self.phases.setdefault(name, {'time': 0.0, 'calls': 0})
+            phase['time'] += seconds
+            phase['calls'] += calls
+
+    def rule(self, name, expression):
+        key = (name, expression)
+        with self.lock:
+            if key not in self.rules:
+                self.rules[key] = RuleStats(name, expression)
+            return self.rules[key]
+
+    # the n rules with the largest value of key, one of the RuleStats.to_dict fields
+    def top_rules(self, n=10, key='total_time'):
+        rules = [r.to_dict() for r in self.rules.values()]
+        rules.sort(key=lambda r: -1 if r[key] is None else r[key], reverse=True)
+        return rules[:n]
+
+    # the share of the decision options hit over all the rules built in coverage mode
+    def coverage(self):
+        targets = sum(r.targets for r in self.rules.values())
+        return sum(r.covered for r in self.rules.values()) / targets if targets else None
+
+    # the n rules with the lowest coverage, the ones whose sample pools missed some options
+    def least_covered_rules(self, n=10):
+        rules = [r.to_dict() for r in self.rules.values() if r.targets]
+        rules.sort(key=lambda r: r['coverage'])
+        return rules[:n]
+
+    def to_dict(self, top=20):
+        with self.lock:
+            return self.summary(top)
+
+    def summary(self, top):
+        return {'phases': {name: dict(phase) for name, phase in self.phases.items()},
+                'rules': {'count': len(self.rules),
+                          'builds': sum(r.builds for r in self.rules.values()),
+                          'traversals': sum(r.traversals for r in self.rules.values()),
+                          'exhausted': sum(r.exhausted for r in self.rules.values()),
+                          'coverage': self.coverage()},
+                'hottest_rules': self.top_rules(top),
+                'least_covered_rules': self.least_covered_rules(top)}
+
+    def to_json(self, fname=None, top=20):
+        if fname is None:
+            return json.dumps(self.to_dict(top), indent=2)
+        with open(fname, 'w') as f:
+            json.dump(self.to_dict(top), f, indent=2)
+
+    # the raw counters, as sent back from worker processes and merged with merge()
+    def state(self):
+        return {'phases': self.phases, 'rules': {key: r.to_dict() for key, r in self.rules.items()}}
+
+    def merge(self, state):
+        with self.lock:
+            for name, phase in state['phases'].items():
+                self.add_phase(name, phase['time'], phase['calls'])
+            for (name, expression), rule in state['rules'].items():
+                self.rule(name, expression).merge(rule)
+
+    def reset(self):
+        with self.lock:
+            self.phases = {}
+            self.rules = {}
+
+
+# times a phase on stats, or does nothing when stats is None
+def timed(stats, name):
+    return nullcontext() if stats is None else stats.phase(name)
@@ -0,0 +1,193 @@
+import gzip
+import io
+import json
+import os
+import re
+
+import pandas as pd
+
+# a line ended by any of the newlines of universal newlines mode, or the last line without one
+NEWLINE_REGEX = re.compile(r'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+')
+
+
+# Readers that stream the utterances of a file, holding at most one line (or one chunk of csv lines)
+# in memory. A reader can be iterated again, every iteration reads the file from the start. A file name
+# ending with .gz is gzip compressed.
+# With shard=(index, count) a reader yields only the lines that start in the index-th of count equal
+# byte ranges of the file, so count workers can split a file between them without reading all of it.
+# A gzip file cannot be split by bytes, its shards are every count-th line instead. Sharding assumes
+# that records do not span lines, also in csv files.
+class UtteranceReader:
+    def __init__(self, fname, shard=None):
+        if shard is not None and not 0 <= shard[0] < shard[1]:
+            raise Exception(f'Error invalid shard {shard[0]} of {shard[1]}')
+        self.fname = fname
+        self.shard = shard
+        self.compressed = fname.endswith('.gz')
+
+    def __iter__(self):
+        return self.read()
+
+    def read(self):
+        raise NotImplementedError
+
+    def open(self):
+        if self.compressed:
+            return gzip.open(self.fname, 'rb')
+        return open(self.fname, 'rb')
+
+    # the lines of the shard as text, with universal newlines like a file opened in text mode. With
+    # skip_header the lines before the first line that is not blank or a # comment, and that line, are
+    # not part of any shard.
+    def lines(self, skip_header=False):
+        with self.open() as f:
+            if skip_header:
+                self.header(f)
+            for line in self.shard_lines(f):
+                line = line.decode('utf-8')
+                if '\r' not in line:
+                    yield line
+                    continue
+                for part in NEWLINE_REGEX.findall(line):
+                    yield part.replace('\r\n', '\n').replace('\r', '\n')
+
+    def header(self, f):
+        for line in f:
+            stripped = line.strip()
+            if stripped and not stripped.startswith(b'#'):
+                return line.decode('utf-8')
+        return ''
+
+    def shard_lines(self, f):
+        if self.shard is None:
+            yield from f
+            return
+        index, count = self.shard
+        if self.compressed:
+            for i, line in enumerate(f):
+                if i % count == index:
+                    yield line
+            return
+
+        size = os.path.getsize(self.fname)
+        start, end = size * index // count, size * (index + 1) // count
+        position = f.tell()
+        if start > position:
+            # the line that contains start - 1 belongs to the previous shard
+            f.seek(start - 1)
+            f.readline()
+            position = f.tell()
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line
+            position += len(line)
+
+
+class TextUtteranceReader(UtteranceReader):
+    # one utterance per line, with its newline as readlines() returns it
+    def read(self):
+        return self.lines()
+
+
+class CsvUtteranceReader(UtteranceReader):
+    # the utterances of one column of a csv file with a header, lowercased and trimmed, read in chunks
+    # of chunk_size rows. The whole file is read with pandas, so quoted values may span lines, a shard is
+    # parsed from its lines.
+    def __init__(self, fname, shard=None, column='response', chunk_size=10000, converter=None):
+        super().__init__(fname, shard)
+        self.column = column
+        self.chunk_size = chunk_size
+        self.converter = converter or normalize_utterance
+
+    def read(self):
+        if self.shard is None:
+            return self.read_all()
+        return self.read_shard()
+
+    def read_all(self):
+        chunks = pd.read_csv(self.fname, comment="#", chunksize=self.chunk_size,
+                             converters={self.column: self.converter})
+        for df in chunks:
+            if self.column not in df.columns:
+                raise Exception(f'Error {self.fname} has no column {self.column}')
+            yield from df[self.column].values.tolist()
+
+    def read_shard(self):
+        with self.open() as f:
+            names = pd.read_csv(io.StringIO(self.header(f)), comment="#").columns.tolist()
+        if self.column not in names:
+            raise Exception(f'Error {self.fname} has no column {self.column}')
+        chunk = []
+        for line in self.lines(skip_header=True):
+            chunk.append(line)
+            if len(chunk) >= self.chunk_size:
+                yield from self.parse(chunk, names)
+                chunk = []
+        if chunk:
+            yield from self.parse(chunk, names)
+
+    def parse(self, lines, names):
+        df = pd.read_csv(io.StringIO(''.join(lines)), header=None, names=names, comment="#",
+                         converters={self.column: self.converter})
+        return df[self.column].values.tolist()
+
+
+class JsonlUtteranceReader(UtteranceReader):
+    # one json value per line, either the utterance itself or an object with the utterance in field
+    def __init__(self, fname, shard=None, field='utterance'):
+        super().__init__(fname, shard)
+        self.field = field
+
+    def read(self):
+        for line in self.lines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict):
+                if self.field not in record:
+                    raise Exception(f'Error a record of {self.fname} has no field {self.field}: {line.strip()}')
+                record = record[self.field]
+            yield record
+
+
+class MultiUtteranceReader:
+    # the utterances of several readers one after the other
+    def __init__(self, readers):
+        self.readers = readers
+
+    def __iter__(self):
+        for reader in self.readers:
+            yield from reader
+
+
+def normalize_utterance(s):
+    s = s.lower()
+    s = s.strip()
+    return s
+
+
+# A reader of the utterances in fname, or in every file of a list of names. fmt is 'text', 'csv' or
+# 'jsonl', by default it follows the extension (before .gz) and files of other extensions are text.
+def open_utterances(fname, fmt=None, shard=None, **kwargs):
+    if type(fname) == list:
+        return MultiUtteranceReader([open_utterances(f, fmt, shard, **kwargs) for f in fname])
+    if fmt is None:
+        fmt = utterances_format(fname)
+    if fmt == 'text':
+        return TextUtteranceReader(fname, shard)
+    if fmt == 'csv':
+        return CsvUtteranceReader(fname, shard, **kwargs)
+    if fmt == 'jsonl':
+        return JsonlUtteranceReader(fname, shard, **kwargs)
+    raise Exception(f'Error unknown utterances format {fmt}')
+
+
+def utterances_format(fname):
+    name = fname[:-3] if fname.endswith('.gz') else fname
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith('.jsonl') or name.endswith('.json'):
+        return 'jsonl'
+    return 'text'
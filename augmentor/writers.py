@@ -0,0 +1,78 @@
+import csv
+import gzip
+import io
+import json
+
+
+# Writers that stream (utterance, variant) records to a file, keeping at most buffer_size records in
+# memory. A file name ending with .gz is gzip compressed.
+class VariationsWriter:
+    def __init__(self, fname, buffer_size=10000):
+        self.fname = fname
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.records = 0
+        if fname.endswith('.gz'):
+            self.file_handler = gzip.open(fname, 'wt', encoding='utf-8', newline='')
+        else:
+            self.file_handler = open(fname, 'w', encoding='utf-8', newline='')
+        self.write_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_header(self):
+        pass
+
+    def format(self, utterance, variant):
+        raise NotImplementedError
+
+    def write(self, utterance, variant):
+        self.buffer.append(self.format(utterance, variant))
+        self.records += 1
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def write_all(self, records):
+        for utterance, variant in records:
+            self.write(utterance, variant)
+
+    def flush(self):
+        if self.buffer:
+            self.file_handler.write(''.join(self.buffer))
+            self.buffer = []
+        self.file_handler.flush()
+
+    def close(self):
+        if self.file_handler is not None:
+            self.flush()
+            self.file_handler.close()
+            self.file_handler = None
+
+
+class JsonlWriter(VariationsWriter):
+    def format(self, utterance, variant):
+        return json.dumps({'utterance': utterance, 'variant': variant}, ensure_ascii=False) + '\n'
+
+
+class CsvWriter(VariationsWriter):
+    def write_header(self):
+        self.file_handler.write(self.format('utterance', 'variant'))
+
+    def format(self, utterance, variant):
+        line = io.StringIO()
+        csv.writer(line).writerow([utterance, variant])
+        return line.getvalue()
+
+
+# picks the writer by the file extension: .jsonl or .csv, optionally followed by .gz
+def open_writer(fname, buffer_size=10000):
+    name = fname[:-3] if fname.endswith('.gz') else fname
+    if name.endswith('.jsonl') or name.endswith('.json'):
+        return JsonlWriter(fname, buffer_size)
+    if name.endswith('.csv'):
+        return CsvWriter(fname, buffer_size)
+    raise Exception(f'Error unsupported output format: {fname}')
@@ -0,0 +1,140 @@
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from augmentor import Augmentor
+from augmentor.Regex import RegexSampler
+from augmentor.reader import ExpressionsReader
+from benchmarks.synthetic import SyntheticTable
+
+
+class Benchmark:
+    # Times the stages of the augmentor on a synthetic rule table. Every stage is run `repeats`
+    # times and its min and median wall times are reported, with the number of items it handled
+    # so that runs over different table sizes can still be compared per item.
+
+    def __init__(self, table, repeats=5, max_variants=100, samples=10000, seed=0):
+        self.table = table
+        self.repeats = repeats
+        self.max_variants = max_variants
+        self.samples = samples
+        self.seed = seed
+        self.results = {}
+
+    def measure(self, name, items, func):
+        times = []
+        for _ in range(self.repeats):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        median = float(np.median(times))
+        self.results[name] = {'min': min(times), 'median': median, 'items': items,
+                              'per_item': median / items if items else None}
+        return self.results[name]
+
+    def run(self, directory):
+        expressions_fname, utterances_fname = self.table.write(directory)
+        reader = ExpressionsReader()
+        self.measure('read_expressions', self.table.n_rules, lambda: reader.read_expressions(expressions_fname))
+
+        expressions_df = reader.read_expressions(expressions_fname)
+        exprs = expressions_df[expressions_df.output_only == False].expression.tolist()
+        self.measure('compile', len(exprs), lambda: [RegexSampler().compile(exp) for exp in exprs])
+        rng = np.random.default_rng(self.seed)
+        self.measure('generate_tree', len(exprs),
+                     lambda: [RegexSampler().generate_tree(exp, self.max_variants, rng=rng) for exp in exprs])
+
+        # the deepest rule is the first one, the resolved rules are ordered from the rules that use others
+        sampler = RegexSampler()
+        sampler.compile(exprs[0])
+        tree = sampler.tree
+        self.measure('traverse_tree', self.samples,
+                     lambda: [tree.traverse_tree(rng=rng) for _ in range(self.samples)])
+        self.measure('sample_batch', self.samples, lambda: tree.sample_batch(self.samples, rng))
+
+        augmentor = Augmentor(expressions_fname, utterances_fname, seed=self.seed)
+        utterances = list(augmentor.utterances)
+        self.measure('change_to_logical_rules', len(utterances),
+                     lambda: [augmentor.change_to_logical_rules(u) for u in utterances])
+        # a fresh augmentor every time, the sample cache would otherwise make the later runs trivial
+        self.measure('calc_variations', len(utterances),
+                     lambda: Augmentor(expressions_fname, utterances_fname, seed=self.seed).calc_variations(
+                         self.max_variants))
+        return self.report()
+
+    def report(self):
+        return {'config': dict(self.table.config(), repeats=self.repeats, max_variants=self.max_variants,
+                               samples=self.samples, seed=self.seed),
+                'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                                'platform': platform.platform()},
+                'results': self.results}
+
+
+# The ratio of the min times of every benchmark to the baseline, benchmarks slower than the
+# baseline by more than threshold are regressions
+def compare(report, baseline, threshold=1.1):
+    rows = []
+    for name, result in report['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            rows.append((name, result['min'], None, None, False))
+            continue
+        ratio = result['min'] / base['min']
+        rows.append((name, result['min'], base['min'], ratio, ratio > threshold))
+    return rows
+
+
+def print_comparison(rows):
+    print(f'{"benchmark":<26}{"min":>12}{"baseline":>12}{"ratio":>9}')
+    for name, best, base, ratio, regressed in rows:
+        if base is None:
+            print(f'{name:<26}{best:>12.4f}{"-":>12}{"-":>9}')
+        else:
+            print(f'{name:<26}{best:>12.4f}{base:>12.4f}{ratio:>9.2f}{"  REGRESSION" if regressed else ""}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the augmentor on a synthetic rule table')
+    parser.add_argument('--rules', type=int, default=200)
+    parser.add_argument('--depth', type=int, default=3, help='length of the longest reference chain')
+    parser.add_argument('--fanout', type=int, default=4, help='alternatives of every branch')
+    parser.add_argument('--max-repeat', type=int, default=3, help='upper bound of the repeat ranges')
+    parser.add_argument('--utterances', type=int, default=50)
+    parser.add_argument('--max-variants', type=int, default=100)
+    parser.add_argument('--samples', type=int, default=10000, help='samples drawn by the traversal benchmarks')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results as json to this file')
+    parser.add_argument('--baseline', help='compare to the results in this json file')
+    parser.add_argument('--threshold', type=float, default=1.1,
+                        help='slowdown ratio to the baseline that counts as a regression')
+    args = parser.parse_args(argv)
+
+    table = SyntheticTable(args.rules, args.depth, args.fanout, args.max_repeat, args.utterances, args.seed)
+    benchmark = Benchmark(table, args.repeats, args.max_variants, args.samples, args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        report = benchmark.run(directory)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['config'] != report['config']:
+            print(f'Warning: baseline config {baseline["config"]} differs from {report["config"]}')
+        rows = compare(report, baseline, args.threshold)
+        print_comparison(rows)
+        return 1 if any(regressed for *_, regressed in rows) else 0
+
+    print_comparison(compare(report, {'results': {}}))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
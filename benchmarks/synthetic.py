@@ -0,0 +1,96 @@
+import os
+
+import numpy as np
+
+SYLLABLES = ['ba', 'ko', 'ri', 'tu', 'me', 'sa', 'lo', 'ni', 'pe', 'da', 'vi', 'gu', 'ze', 'mo', 'ta', 'fi']
+
+
+class SyntheticTable:
+    # Generates a rule table in the format of regex_table.csv and utterances that use its rules.
+    # The rules are built in layers, rules of layer 0 are alternations of words and every rule of
+    # layer k > 0 references a rule of layer k - 1, so depth is the length of the longest reference
+    # chain. Everything is drawn from a generator seeded with seed, the same arguments give the
+    # same files.
+
+    def __init__(self, n_rules=200, depth=3, fanout=4, max_repeat=3, n_utterances=50, seed=0):
+        if n_rules < depth + 1:
+            raise Exception(f'Error {n_rules} rules are not enough for reference depth {depth}')
+        self.n_rules = n_rules
+        self.depth = depth
+        self.fanout = fanout
+        self.max_repeat = max_repeat
+        self.n_utterances = n_utterances
+        self.rng = np.random.default_rng(seed)
+        self.used_words = set()
+        self.layers = []
+        self.rows = []
+        self.build_rules()
+
+    def config(self):
+        return {'rules': self.n_rules, 'depth': self.depth, 'fanout': self.fanout, 'max_repeat': self.max_repeat,
+                'utterances': self.n_utterances}
+
+    # a word that no other rule uses, so that every rule matches only its own words
+    def new_word(self):
+        while True:
+            n = self.rng.integers(2, 5)
+            word = ''.join(self.rng.choice(SYLLABLES, n))
+            if word not in self.used_words:
+                self.used_words.add(word)
+                return word
+
+    def alternation(self, n_options):
+        options = []
+        for _ in range(n_options):
+            word = self.new_word()
+            if self.rng.random() < 0.3:
+                word += f' ~{self.rng.integers(1, 100)}'
+            options.append(word)
+        return '(' + '|'.join(options) + ')'
+
+    def repeat(self):
+        low = int(self.rng.integers(0, self.max_repeat))
+        high = int(self.rng.integers(low + 1, self.max_repeat + 1))
+        weights = ','.join(str(w) for w in self.rng.integers(1, 20, high - low + 1))
+        return f'({self.new_word()} ){{{low},{high}}}<{weights}>'
+
+    def build_rules(self):
+        per_layer = [self.n_rules // (self.depth + 1)] * (self.depth + 1)
+        per_layer[0] += self.n_rules - sum(per_layer)
+        for layer, count in enumerate(per_layer):
+            names = []
+            for i in range(count):
+                name = f'<<l{layer}_r{i}>>'
+                if layer == 0:
+                    expr = self.alternation(self.fanout)
+                else:
+                    ref = self.layers[layer - 1][self.rng.integers(len(self.layers[layer - 1]))]
+                    expr = f'{self.repeat()}{ref} {self.alternation(max(1, self.fanout // 2))}'
+                self.rows.append((expr, name))
+                names.append(name)
+            self.layers.append(names)
+
+    # utterances made of plain words from the rules of layer 0, so that they are rewritten into references
+    def utterances(self):
+        leaf_rules = [expr for expr, name in self.rows if name.startswith('<<l0_')]
+        out = []
+        for _ in range(self.n_utterances):
+            words = ['please']
+            for _ in range(self.rng.integers(1, 4)):
+                expr = leaf_rules[self.rng.integers(len(leaf_rules))]
+                options = expr[1:-1].split('|')
+                words.append(options[self.rng.integers(len(options))].split(' ~')[0])
+                words.append(self.new_word())
+            out.append(' '.join(words))
+        return out
+
+    def write(self, directory):
+        expressions_fname = os.path.join(directory, 'regex_table.csv')
+        utterances_fname = os.path.join(directory, 'texts.txt')
+        with open(expressions_fname, 'w') as f:
+            for expr, name in self.rows:
+                f.write(f'{expr};{name}\n')
+        with open(utterances_fname, 'w') as f:
+            for utter in self.utterances():
+                f.write(utter + '\n')
+        return expressions_fname, utterances_fname
@@ -0,0 +1,32 @@
+import os
+
+from augmentor.generator import Augmentor
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+RULE_TABLE = os.path.join(ROOT, 'regex_table.csv')
+TEXTS = os.path.join(ROOT, 'texts.txt')
+
+
+def cold_variations(**kwargs):
+    return Augmentor(RULE_TABLE, TEXTS, seed=3, **kwargs).calc_variations(20)
+
+
+def test_bundle_gives_the_variations_of_a_cold_augmentor(tmp_path):
+    expected = cold_variations()
+    bundle_path = str(tmp_path / 'rules.bundle')
+    built = Augmentor.from_bundle(bundle_path, RULE_TABLE, TEXTS, seed=3)
+    assert os.path.exists(bundle_path)
+    assert built.calc_variations(20) == expected
+    loaded = Augmentor.from_bundle(bundle_path, RULE_TABLE, TEXTS, seed=3)
+    assert loaded.calc_variations(20) == expected
+    assert loaded.calc_variations(20, unique=True) == Augmentor(RULE_TABLE, TEXTS, seed=3).calc_variations(
+        20, unique=True)
+
+
+def test_process_pool_gives_the_variations_of_a_sequential_augmentor(tmp_path):
+    expected = cold_variations()
+    assert Augmentor(RULE_TABLE, TEXTS, seed=3).calc_variations(20, jobs=2) == expected
+    bundled = Augmentor.from_bundle(str(tmp_path / 'rules.bundle'), RULE_TABLE, TEXTS, seed=3)
+    reloaded = Augmentor.from_bundle(str(tmp_path / 'rules.bundle'), RULE_TABLE, TEXTS, seed=3)
+    assert bundled.calc_variations(20, jobs=2) == expected
+    assert reloaded.calc_variations(20, jobs=2) == expected
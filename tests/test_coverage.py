@@ -0,0 +1,27 @@
+import numpy as np
+
+from augmentor.Regex import RegexSampler
+
+
+def covering(pattern, seed=0):
+    return RegexSampler().compile(pattern).covering_samples(np.random.default_rng(seed))
+
+
+def test_every_option_is_covered():
+    samples, coverage = covering('(a|b|c~0)(x{0,2})((d|e)f|g)')
+    # 2 alternatives, 3 repeat counts, 2 + 2 nested alternatives, the zero weight c is no target
+    assert coverage.num_targets == 9
+    assert len(coverage.covered) == 9
+    assert set(s[0] for s in samples) == {'a', 'b'}
+    assert {'df', 'ef', 'g'} <= set(s.lstrip('abx') for s in samples)
+
+
+def test_options_under_zero_weight_options_are_not_targets():
+    _, coverage = covering('(a|(b|c)~0)')
+    assert coverage.num_targets == 1
+
+
+def test_long_sequence_is_covered_in_two_traversals():
+    samples, coverage = covering('(a|b)' * 3000)
+    assert len(coverage.covered) == coverage.num_targets == 6000
+    assert len(samples) == 2
@@ -0,0 +1,38 @@
+import pytest
+
+from augmentor.matcher import RuleMatcher
+
+
+def test_matcher_back_reference():
+    matcher = RuleMatcher()
+    matcher.add_rules([('<<dup>>', '(ab|cd)\\1')])
+    assert matcher.rewrite('x abab y') == 'x <<dup>> y'
+
+
+def test_matcher_skips_rules_matching_empty():
+    matcher = RuleMatcher()
+    matcher.add_rules([('<<maybe>>', 'x*'), ('<<b>>', 'b')])
+    assert matcher.rewrite('a b') == 'a <<b>>'
+
+
+def test_matcher_priority_does_not_depend_on_chunks():
+    rules = [('<<york>>', 'york'), ('<<city>>', 'new york'), ('<<new>>', 'new')]
+    expected = None
+    for tail_size in (1, 2, 256):
+        matcher = RuleMatcher(tail_size)
+        matcher.add_rules(rules)
+        rewritten = matcher.rewrite('from new york to <<york>> york')
+        expected = expected or rewritten
+        assert rewritten == expected == 'from <<city>> to <<york>> <<york>>'
+
+
+def test_matcher_named_groups():
+    matcher = RuleMatcher()
+    matcher.add_rules([('<<food>>', '(?P<x>pizza|pasta)'), ('<<drink>>', '(?P<x>tea|coffee)'),
+                       ('<<same>>', '(?P<ref>a|b)(?P=ref)'), ('<<r0>>', '(?P<r0>z)y')])
+    assert matcher.rewrite('one pizza and tea, aa zy <<food>>') == 'one <<food>> and <<drink>>, <<same>> <<r0>> <<food>>'
+
+
+def test_matcher_error_names_the_rule():
+    with pytest.raises(Exception, match='<<bad>>'):
+        RuleMatcher().add_rules([('<<bad>>', '(?P<x>a)(?P<x>b)')])
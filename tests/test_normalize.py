@@ -0,0 +1,57 @@
+import os
+
+import numpy as np
+import pytest
+
+from augmentor.generator import Augmentor
+from augmentor.modules import WeightedChoice
+from augmentor.normalize import assemble, normalize_variation, separable, split_values
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+TOKENS = ['a', 'bc', '_', ' ', '  ', '\t', '\n', '@', '@@', '@@x@@', 'x@@', '@@y', 'é']
+
+
+def random_fragments(rng):
+    frags = []
+    for _ in range(rng.integers(1, 5)):
+        frags.append([''.join(rng.choice(TOKENS, rng.integers(0, 5))) for _ in range(rng.integers(1, 4))])
+    return frags
+
+
+def test_assemble_equals_normalize_variation():
+    rng = np.random.default_rng(0)
+    checked = 0
+    for _ in range(20000):
+        frags = random_fragments(rng)
+        splits = [split_values(values) for values in frags]
+        if not separable(splits):
+            continue
+        row = [rng.integers(len(values)) for values in frags]
+        pieces = [split[0][i] for split, i in zip(splits, row)]
+        raw = ''.join(values[i] for values, i in zip(frags, row))
+        assert assemble(pieces) == normalize_variation(raw), repr(raw)
+        checked += 1
+    assert checked > 5000
+
+
+@pytest.fixture(scope='module')
+def augmentor():
+    return Augmentor(os.path.join(ROOT, 'regex_table.csv'), os.path.join(ROOT, 'texts.txt'), seed=0)
+
+
+# assemble_variants joins separable fragments from their split values and normalizes the others raw
+def test_assemble_variants_equals_normalize_variation(augmentor):
+    rng = np.random.default_rng(1)
+    for _ in range(5000):
+        frags = random_fragments(rng)
+        choices = [WeightedChoice(values) for values in frags]
+        rows = [[rng.integers(len(values)) for values in frags] for _ in range(3)]
+        expected = [normalize_variation(''.join(values[i] for values, i in zip(frags, row))) for row in rows]
+        assert augmentor.assemble_variants(choices, rows, normalized=True) == expected
+
+
+def test_marker_across_fragments(augmentor):
+    frags = [['go x@@'], ['b@@ now', 'c']]
+    assert not separable([split_values(values) for values in frags])
+    choices = [WeightedChoice(values) for values in frags]
+    assert augmentor.assemble_variants(choices, [[0, 0], [0, 1]], normalized=True) == ['go x now', 'go x@@c']
@@ -0,0 +1,76 @@
+import os
+import re
+
+import numpy as np
+import pytest
+
+from augmentor.Regex import RegexSampler
+from augmentor.normalize import normalize_variation
+from augmentor.parser import strip_annotations
+from augmentor.reader import ExpressionsReader
+
+# rules with the constructs of the rule tables: alternatives, weights, repeats, classes, escapes and groups
+RULES = [
+    '(agent~100|representative~50|csr~3) (please|now~1|)',
+    '(hi+<40,5,1,1,1,1>) please',
+    '(x(y|z~1|w~1){0,3}|q~1)(1|2~1)',
+    '(customer support|customer care|support)',
+    '(pizza %|ravioli|pasta)',
+    'a{2,3}b?c*',
+    '(a|b)+',
+    '(ab){2}',
+    '(?:ab|cd)e',
+    '[a-c\\-]{1,2}',
+    '[^a-z]x\\d',
+    '[.]',
+    'a.b',
+    'x\\s?y',
+    '\\w\\W',
+    '\\.\\$\\(x\\)',
+    '(a|b)c\\1',
+    '((a|b)c)\\2\\1',
+    'é|ü',
+]
+
+RULE_TABLE = os.path.join(os.path.dirname(__file__), '..', 'regex_table.csv')
+
+# at most this many derivations are enumerated, larger languages are checked on samples
+ENUMERATE_LIMIT = 5000
+
+
+# the space before a ~N weight stays in the sampled text and is only removed by normalization, while
+# strip_annotations drops it with the weight
+def matches(regex, output):
+    return regex.fullmatch(output) or regex.fullmatch(normalize_variation(output))
+
+
+def outputs(pattern):
+    program = RegexSampler().compile(pattern)
+    if program.language_size() <= ENUMERATE_LIMIT:
+        return list(program.enumerate())
+    return program.sample_batch(500, np.random.default_rng(0))
+
+
+@pytest.mark.parametrize('pattern', RULES)
+def test_outputs_match_pattern(pattern):
+    regex = re.compile(strip_annotations(pattern))
+    for output in outputs(pattern):
+        assert matches(regex, output), f'{output!r} does not match {pattern!r}'
+
+
+def test_rule_table_outputs_match():
+    df = ExpressionsReader().read_expressions(RULE_TABLE)
+    for pattern in df[df.output_only == False].expression:
+        regex = re.compile(strip_annotations(pattern))
+        for output in outputs(pattern):
+            assert 'QQQ' in output or matches(regex, output), f'{output!r} does not match {pattern!r}'
+
+
+def test_word_boundary_is_a_removed_marker():
+    assert sorted(normalize_variation(o) for o in outputs('(a|b)\\bc')) == ['a c', 'b c']
+
+
+def test_deep_nesting_enumerates():
+    pattern = '(a|' * 500 + 'z' + ')' * 500
+    assert sorted(RegexSampler().compile(pattern).enumerate()) == ['a', 'z']
+
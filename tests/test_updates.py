@@ -0,0 +1,62 @@
+import re
+import threading
+
+from augmentor.generator import OUTPUT_ONLY_REGEX, Augmentor
+from benchmarks.synthetic import SyntheticTable
+
+
+def synthetic_augmentor(tmp_path, n_rules=500, seed=0):
+    expressions_fname, utterances_fname = SyntheticTable(n_rules, depth=2, n_utterances=30, seed=seed).write(
+        str(tmp_path))
+    return Augmentor(expressions_fname, utterances_fname, seed=1), utterances_fname
+
+
+def test_readers_see_whole_updates(tmp_path):
+    augmentor, utterances_fname = synthetic_augmentor(tmp_path)
+    utterances = [line.strip() for line in open(utterances_fname)]
+    expected = {u: augmentor.change_to_logical_rules(u) for u in utterances}
+    wrong = []
+    stop = threading.Event()
+
+    def read():
+        while not stop.is_set():
+            for u in utterances:
+                try:
+                    if augmentor.change_to_logical_rules(u) != expected[u]:
+                        wrong.append(u)
+                    augmentor.get_variations_list(u, 5)
+                except Exception as e:
+                    wrong.append(repr(e))
+
+    threads = [threading.Thread(target=read) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for i in range(10):
+        augmentor.update_rules([(f'(zzqx{i}|yyqx{i})', f'<<new{i}>>')])
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert wrong == []
+
+
+# the output only placeholders of an updated rule are numbered after the existing ones, unlike a full read
+def without_placeholders(rules):
+    return [(name, re.sub(OUTPUT_ONLY_REGEX, 'QQQ', expr)) for name, expr in rules]
+
+
+def test_update_equals_full_read_without_placeholders(tmp_path):
+    rows = ['(one %|two|three);<<num>>', '(<<num>> )?(apples %|pears);<<fruit>>',
+            '(buy|get) <<fruit>>;<<order>>', '(red|green %);<<color>>']
+    expressions_fname = tmp_path / 'rules.csv'
+    utterances_fname = tmp_path / 'texts.txt'
+    expressions_fname.write_text('\n'.join(rows) + '\n')
+    utterances_fname.write_text('buy two pears\n')
+    augmentor = Augmentor(str(expressions_fname), str(utterances_fname), seed=1)
+
+    rows[0] = '(four %|five %|six);<<num>>'
+    augmentor.update_rules([('(four %|five %|six)', '<<num>>')])
+    expressions_fname.write_text('\n'.join(rows) + '\n')
+    fresh = Augmentor(str(expressions_fname), str(utterances_fname), seed=1)
+
+    assert without_placeholders(augmentor.rules) == without_placeholders(fresh.rules)
+    assert sorted(augmentor.output_only_expr.expression) == sorted(fresh.output_only_expr.expression)
@@ -0,0 +1,50 @@
+import gzip
+
+import pytest
+
+from augmentor.utterances import CsvUtteranceReader, open_utterances
+
+LINES = [f'utterance number {i} with some words{"!" * (i % 7)}\n' for i in range(103)]
+
+
+@pytest.fixture
+def text_file(tmp_path):
+    fname = tmp_path / 'texts.txt'
+    fname.write_text(''.join(LINES))
+    return str(fname)
+
+
+@pytest.fixture
+def gzip_file(tmp_path):
+    fname = tmp_path / 'texts.txt.gz'
+    with gzip.open(fname, 'wt') as f:
+        f.write(''.join(LINES))
+    return str(fname)
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    fname = tmp_path / 'texts.csv'
+    rows = [f'{i},{line.strip().upper()}\n' for i, line in enumerate(LINES)]
+    fname.write_text('# exported utterances\n#\nid,response\n' + ''.join(rows))
+    return str(fname)
+
+
+def expected(fname):
+    if fname.endswith('.csv'):
+        return [line.strip() for line in LINES]
+    return LINES
+
+
+@pytest.mark.parametrize('fixture', ['text_file', 'gzip_file', 'csv_file'])
+@pytest.mark.parametrize('count', [1, 2, 3, 8, 200])
+def test_shards_partition_the_lines(fixture, count, request):
+    fname = request.getfixturevalue(fixture)
+    shards = [list(open_utterances(fname, shard=(k, count))) for k in range(count)]
+    merged = [line for shard in shards for line in shard]
+    assert sorted(merged) == sorted(expected(fname))
+    assert list(open_utterances(fname)) == expected(fname)
+
+
+def test_csv_reads_every_row(csv_file):
+    assert len(list(CsvUtteranceReader(csv_file, chunk_size=7))) == len(LINES)
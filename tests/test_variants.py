@@ -0,0 +1,61 @@
+import itertools
+import os
+
+import pytest
+
+from augmentor.generator import Augmentor
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+RULE_TABLE = os.path.join(ROOT, 'regex_table.csv')
+TEXTS = os.path.join(ROOT, 'texts.txt')
+
+
+def augmentor(seed=7):
+    return Augmentor(RULE_TABLE, TEXTS, seed=seed)
+
+
+def test_variations_without_rng_follow_the_seed():
+    runs = []
+    for _ in range(2):
+        a = augmentor()
+        a.get_variations_list('i want pizza from an agent', 20)
+        runs.append(a.calc_variations_for_utterance(20, normalized=True))
+    assert runs[0] == runs[1]
+
+
+UTTERANCES = ['call (x|x |x  ) now', 'i want pizza from an agent', 'customer support (a|b|c) agent',
+              '(greetings:hi+<40,5,1,1,1,1>) please give me one pizza and one pasta',
+              'i (desire:want~100|would like~50|need) to talk to a csr']
+
+
+# every variant of the utterance in the order of the product of its fragments, normalized
+def ordered_product(a, utter, max_variants):
+    frags = a.utterance_fragmentations(utter, max_variants)
+    return [a.normalize_variation(''.join(values)) for values in itertools.product(*[f.values for f in frags])]
+
+
+@pytest.mark.parametrize('utter', UTTERANCES)
+@pytest.mark.parametrize('max_variants', [2, 5, 40])
+def test_unique_variants_are_distinct_and_from_the_product(utter, max_variants):
+    a = augmentor()
+    distinct = set(ordered_product(a, utter, max_variants))
+    variants = a.get_variations_list(utter, max_variants, unique=True, normalized=True)
+    assert len(variants) == len(set(variants)) == min(max_variants, len(distinct))
+    assert set(variants) <= distinct
+
+
+def test_unique_merges_values_that_normalize_alike():
+    assert augmentor().get_variations_list('call (x|x |x  ) now', 10, unique=True, normalized=True) == ['call x now']
+
+
+@pytest.mark.parametrize('utter', UTTERANCES)
+def test_variant_at_and_page_follow_the_product(utter):
+    a = augmentor()
+    product = ordered_product(a, utter, 5)
+    assert a.variant_count(utter, 5) == len(product)
+    assert [a.variant_at(utter, k, 5) for k in range(len(product))] == product
+    assert a.variant_at(utter, -1, 5) == product[-1]
+    assert a.page(utter, 0, len(product) + 3, 5) == product
+    assert a.page(utter, 2, 7, 5) == product[2:7]
+    with pytest.raises(IndexError):
+        a.variant_at(utter, len(product), 5)